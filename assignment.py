@@ -1,39 +1,81 @@
+import argparse
 import csv
 import time 
-from qgis.PyQt.QtCore import QVariant
-from qgis.core import (
-    QgsProject,
-    QgsCoordinateReferenceSystem,
-    QgsCoordinateTransform,
-    QgsPointXY,
-    QgsGeometry,
-    QgsVectorLayer,
-    QgsField,
-    QgsFeature,
-    QgsApplication
-)
+try:
+    from qgis.PyQt.QtCore import QVariant
+    from qgis.core import (
+        QgsProject,
+        QgsCoordinateReferenceSystem,
+        QgsCoordinateTransform,
+        QgsPointXY,
+        QgsGeometry,
+        QgsVectorLayer,
+        QgsField,
+        QgsFeature,
+        QgsFeatureRequest,
+        QgsSpatialIndex,
+        QgsVectorFileWriter,
+        QgsApplication
+    )
+except ImportError:
+    # No QGIS install: the helpers still work and the layers use the shapely backend
+    QgsApplication = None
 import requests
 import os
-from geopy.geocoders  import Nominatim
+import bisect
 import hashlib
+import json
+import logging
+import multiprocessing
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timezone
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from array import array
 from tqdm import tqdm 
 
+# Optional: vectorized batch reprojection
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from pyproj import Transformer
+except ImportError:
+    Transformer = None
+
+# Optional: vectorized bulk spatial join
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+# Optional: QGIS-free geometry backend (pyogrio reads the shapefiles, shapely + pyproj do the geometry)
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
 #region GLOBAL VARIABLES----------
 
 # Supply path to QGIS install location
 QGIS_PREFIX_PATH = r'C:/Program Files/QGIS 3.40.10/apps/qgis'
 
-# Create a reference to the QgsApplication. Setting the second argument to False disables the GUI.
-qgs = QgsApplication([], False)
-qgs.setPrefixPath(QGIS_PREFIX_PATH, True)
+# QgsApplication and project, created by init_qgis() the first time a QGIS layer is needed
+qgs = None
+qgis_project = None
 
-#initialize the QGIS application
-qgs.initQgis()
-
-qgis_project = QgsProject.instance()
-#"EPSG:4326" is WGS84
-# "EPSG:2240" is NAD83 / Georgia West (ftUS)    
-qgis_project.setCrs(QgsCoordinateReferenceSystem("EPSG:2240"))  # Set project CRS to EPSG:2240 (NAD83 / Georgia West)
+# Geometry backend for the loaded layers: "qgis", "shapely" (pyogrio + shapely + pyproj, no QGIS needed)
+# or "auto" (QGIS when it is installed)
+GEOMETRY_BACKEND = "auto"
 
 # ArcGIS services to query
 ARC_SERVICES = [
@@ -44,12 +86,42 @@ ARC_SERVICES = [
     # Direct layer URL (building footprints):
     "https://gis.atlantaga.gov/dpcd/rest/services/OpenDataService1/MapServer/10"
 ]
+# Indexes into ARC_SERVICES of the services answering per building rather than per parcel
+ARC_BUILDING_SERVICES = (2,)
+
+# ArcGIS client settings
+ARC_MAX_CONNECTIONS_PER_HOST = 4    # concurrent requests allowed against one host
+ARC_MAX_WORKERS = 16                # threads shared by all services / addresses
+ARC_MAX_RETRIES = 3                 # retries on connection errors and 429/5xx answers
+ARC_RETRY_BACKOFF = 0.5             # seconds, doubled on every retry
+ARC_REQUEST_TIMEOUT = 15
+
+# ArcGIS batch mode: Step 2.2 sends one multipoint query per tile of addresses per service
+ARC_BATCH_MODE = True
+ARC_BATCH_TILE_SIZE = 0.01          # tile edge in degrees (~1 km in Atlanta)
+ARC_BATCH_MAX_POINTS = 100          # points per multipoint query, sent as a form POST (~4 KB of geometry)
+ARC_BATCH_PAGE_SIZE = 1000          # resultRecordCount when the service supports pagination
+
+# Offline mirror of ARC_SERVICES (GeoPackage, relative to project_path) and the layer each service is stored in
+ARC_MIRROR_PATH = "Open_Data_Recources/ArcGIS_Mirror/arc_services.gpkg"
+ARC_MIRROR_LAYERS = {"Arc_Tax_Parcels_Atlanta": ARC_SERVICES[0],
+                     "Arc_Tax_Parcels_Fulton": ARC_SERVICES[1],
+                     "Arc_Structure_Footprints": ARC_SERVICES[2]}
+# Step 2.2 reads the mirror layers instead of querying the services
+ARC_USE_MIRROR = False
 
 # Fields we will search for (case-insensitive)
 POSSIBLE_PARCEL_ID_KEYS = ["PARCELID","PARCEL_ID","APN","PIN","PARCEL","APN_ID","PIN_NUM","PARC_NUM","ParcelID","parcel_id","ParcelId","APN", "APN_ID", "APN ID"]
 POSSIBLE_STORY_KEYS = ["STORIES","NUM_STORIES","BldgStories","BLDG_STORY","STORY","Story","stories","num_stories","bldg_stories"]
 POSSIBLE_BUILD_ID_KEYS  = ["BIN", "STRUCTUREID", "STRUCTURE_ID", "STRUCT_ID","BLD_ID","BUILDINGID","BUILDING_ID","BUILDINGID","BUILDING_ID","BuildingId","building_id","BuildingID"]
 
+# Attributes resolved for every address and the field names each one may appear under
+ATTRIBUTE_KEYS = {"parcel_id": POSSIBLE_PARCEL_ID_KEYS,
+                  "stories": POSSIBLE_STORY_KEYS,
+                  "build_id": POSSIBLE_BUILD_ID_KEYS}
+# Values treated as "not found"
+MISSING_VALUES = ('', ' ', "NULL", "NaN")
+
 # Define paths and parameters
 project_path = "C:/Users/xxxx/Desktop/Projects/PyQGIS_Projects/Newmark_Assignment/"
 # Input CSV with 'address' column
@@ -58,7 +130,90 @@ csv_input = r"C:/Users/xxxx/Desktop/Projects/PyQGIS_Projects/Newmark_Assignment/
 layer_name_path = {"Tax_Parcels":"Open_Data_Recources/Atlanta_Tax_Parcels/Tax_Parcels.shp",
                    "Structure_Footprints": "Open_Data_Recources/Atlanta_Structure_Footprints/Structure_Footprints.shp"}  
        
+# Mirror layers, loaded through load_layers() like the shapefiles
+arc_mirror_layer_name_path = {layer_name: f"{ARC_MIRROR_PATH}|layername={layer_name}" for layer_name in ARC_MIRROR_LAYERS}
+
 csv_output = r"C:/Users/xxxx/Desktop/Projects/PyQGIS_Projects/Newmark_Assignment/Output_Files/output_results.csv"
+OUTPUT_FIELDNAMES = ["address", "lat", "lon", "parcel_id", "stories", "build_id", "bin", "match_type", "match_distance", "error"]
+# error of a row whose Step 2.2 was cut short by a failed ArcGIS service; such rows are not kept for incremental runs
+ARC_FAILED_ERROR = "ArcGIS service failed"
+
+# Streaming pipeline: rows geocoded / resolved together (one ArcGIS batch per chunk) and rows per output flush + checkpoint
+PIPELINE_CHUNK_SIZE = 500
+OUTPUT_FLUSH_ROWS = 100
+
+# Incremental runs (--incremental): results are kept in output_csv + '.state.db' and reused while the address, its geocode
+# and the layers / services near it are unchanged. Rows older than INCREMENTAL_MAX_AGE are resolved again regardless,
+# which also picks up service edits that cannot be detected (no edit date, deleted features).
+INCREMENTAL_MAX_AGE = 30 * 24 * 3600
+
+# Spatial indexes of the loaded layers, built once in load_layers() and keyed by layer id
+LAYER_INDEXES = {}
+
+# Step 2.1 matching: the feature containing the point, otherwise the nearest of the NEAREST_K closest features within
+# NEAREST_MAX_DISTANCE (layer units) that holds the attribute; equally distant features go by lowest fid
+NEAREST_MAX_DISTANCE = 10
+NEAREST_K = 5
+
+# Bulk spatial join: Step 2.1 for a whole chunk at once against array-backed copies of the layers
+BULK_JOIN_MODE = False
+# Array-backed layers built by get_bulk_layer(), keyed by layer id
+BULK_LAYERS = {}
+
+# Lookup service (--serve): address and largest batch it accepts
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_MAX_BATCH = 1000
+
+# Coordinate transforms keyed by (source CRS, destination CRS), and pyproj transformers from WGS84 keyed by destination CRS
+COORDINATE_TRANSFORMS = {}
+PYPROJ_TRANSFORMERS = {}
+
+# Persistent geocode cache (SQLite), kept next to symbology-style.db
+GEOCODE_CACHE_PATH = project_path + "geocode-cache.db"
+GEOCODE_CACHE_TTL = 90 * 24 * 3600           # seconds a found location is reused
+GEOCODE_CACHE_NEGATIVE_TTL = 3 * 24 * 3600   # seconds a "not found" answer is reused
+GEOCODE_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# Deduplication: geocoded points closer than this (degrees, ~1 m) are resolved once, and with
+# DEDUP_BY_PARCEL points whose Step 2.1 found the same parcel and building share one Step 2.2 lookup
+# (without a building, they share only the answers of the parcel services, see ARC_BUILDING_SERVICES)
+DEDUP_POINT_TOLERANCE = 0.00001
+DEDUP_BY_PARCEL = True
+DEDUP_STATS = {"addresses": 0, "points": 0, "parcels": 0, "parcel_services": 0}
+
+# Counters summed over the worker processes of a parallel run
+PIPELINE_COUNTERS = (GEOCODE_CACHE_STATS, DEDUP_STATS)
+
+# Minimum seconds between requests to each geocoding provider (Nominatim policy: 1 request/second), the
+# token bucket refill rate, and the bucket size: requests that may go out back to back after an idle period
+GEOCODE_MIN_INTERVAL = {"local": 0.0, "nominatim": 1.0, "google": 1 / 50}
+GEOCODE_BURST = {"local": 1, "nominatim": 1, "google": 10}
+
+# Geocoding endpoints (the benchmark suite points them at its local stand-in servers). LOCAL_GEOCODER_URL is an
+# optional Nominatim-compatible /search endpoint, e.g. a self-hosted Nominatim with the Georgia extract.
+NOMINATIM_SCHEME = "https"
+NOMINATIM_DOMAIN = "nominatim.openstreetmap.org"
+GOOGLE_GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+LOCAL_GEOCODER_URL = None
+
+# Geocoding engine: cost of one request (USD) per provider, providers being tried cheapest first, and the requests
+# each provider may have in flight across all worker processes (Nominatim policy: no parallel requests)
+GEOCODE_COST = {"local": 0.0, "nominatim": 0.0, "google": 0.005}
+GEOCODE_MAX_IN_FLIGHT = {"local": 8, "nominatim": 1, "google": 10}
+GEOCODE_REQUEST_TIMEOUT = 10
+# Seconds an address may wait for its provider; past it the address goes to the next provider by cost
+# whose queue is short enough. None always uses the cheapest provider.
+GEOCODE_LATENCY_BUDGET = None
+# Weight of the newest request in each provider's moving average latency, which orders and routes the providers
+GEOCODE_LATENCY_SMOOTHING = 0.2
+
+# Upper bounds (seconds) of the stage latency histogram buckets, see record_stage()
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Console logging; per-address progress is logged at DEBUG, so the default INFO only shows the run summary and problems
+LOG_LEVEL = "INFO"
+log = logging.getLogger("assignment")
 
 #endregion GLOBAL VARIABLES --------
 
@@ -69,24 +224,101 @@ def create_bin(parcel_id, build_id='NO_BLD'):
     bin_val = 'ATL-BIN-' + hashlib.sha1(base.encode()).hexdigest()[:10].upper()
     return bin_val
 
+def is_missing_value(value):
+    # QGIS NULL variants compare equal to None
+    return value == None or value in MISSING_VALUES
+
+# Subset of ATTRIBUTE_KEYS whose value is still missing in the record
+def missing_attribute_keys(record):
+    return {name: keys for name, keys in ATTRIBUTE_KEYS.items() if is_missing_value(record.get(name))}
+
+# Start QGIS on first use
+def init_qgis():
+    """Returns the QGIS project, creating the QgsApplication the first time."""
+    global qgs, qgis_project
+    if qgis_project is None:
+        if QgsApplication is None:
+            raise RuntimeError("QGIS is not installed, use GEOMETRY_BACKEND = 'shapely'")
+        # Create a reference to the QgsApplication. Setting the second argument to False disables the GUI.
+        qgs = QgsApplication([], False)
+        qgs.setPrefixPath(QGIS_PREFIX_PATH, True)
+
+        #initialize the QGIS application
+        qgs.initQgis()
+
+        qgis_project = QgsProject.instance()
+        #"EPSG:4326" is WGS84
+        # "EPSG:2240" is NAD83 / Georgia West (ftUS)    
+        qgis_project.setCrs(QgsCoordinateReferenceSystem("EPSG:2240"))  # Set project CRS to EPSG:2240 (NAD83 / Georgia West)
+    return qgis_project
+
+def exit_qgis():
+    if qgs is not None:
+        qgs.exitQgis()
+
+def get_geometry_backend():
+    global GEOMETRY_BACKEND
+    if GEOMETRY_BACKEND == "auto":
+        GEOMETRY_BACKEND = "qgis" if QgsApplication is not None else "shapely"
+    return GEOMETRY_BACKEND
+
+# Loaded layers with the given name (empty if it is not loaded)
+def get_loaded_layers(layer_name):
+    if get_geometry_backend() == "shapely":
+        return [SHAPELY_LAYERS[layer_name]] if layer_name in SHAPELY_LAYERS else []
+    return init_qgis().mapLayersByName(layer_name)
+
 # Load parcel layers into QGIS
 def load_layers(project_path, layer_name, layer_path):
 
     path_to_shape_file = project_path + layer_path 
 
+    if get_geometry_backend() == "shapely":
+        load_shapely_layer(layer_name, path_to_shape_file)
+        return
+
+    qgis_project = init_qgis()
     layer = QgsVectorLayer(path_to_shape_file, layer_name, 'ogr')
     if not layer.isValid():
-        print(f'{layer_name} layer failed to load !')
+        log.error(f'{layer_name} layer failed to load !')
     else:
         qgis_project.addMapLayer(layer)
-        print(f'{layer_name} layer loaded successfully!')
+        log.info(f'{layer_name} layer loaded successfully!')
+        build_layer_index(layer)
+
+# Load the layers used by the pipeline: the shapefiles and, with ARC_USE_MIRROR, the ArcGIS mirror layers
+def load_pipeline_layers(layer_name_path):
+    for layer_name, layer_path in layer_name_path.items():
+        with timed_stage(f"load_layer:{layer_name}"):
+            load_layers(project_path, layer_name, layer_path)
+    if ARC_USE_MIRROR:
+        for layer_name, layer_path in arc_mirror_layer_name_path.items():
+            with timed_stage(f"load_layer:{layer_name}"):
+                load_layers(project_path, layer_name, layer_path)
+
+# Build a spatial index (with cached feature geometries) for a loaded layer
+def build_layer_index(loaded_layer):
+    index_start = time.time()
+    index = QgsSpatialIndex(loaded_layer.getFeatures(), flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+    LAYER_INDEXES[loaded_layer.id()] = index
+    log.info(f'{loaded_layer.name()} spatial index built in {time.time() - index_start:.2f}s')
+    return index
+
+# Coordinate transform from source_authid to dest_crs, built once per CRS pair
+def get_coordinate_transform(source_authid, dest_crs):
+    key = (source_authid, dest_crs.authid() or dest_crs.toWkt())
+    if key not in COORDINATE_TRANSFORMS:
+        COORDINATE_TRANSFORMS[key] = QgsCoordinateTransform(QgsCoordinateReferenceSystem(source_authid), dest_crs, init_qgis())
+    return COORDINATE_TRANSFORMS[key]
 
 # Convert geocoded point to QGIS geometry in project CRS 
 def to_project_geom(loaded_layer, lon, lat):
-    # Create point in WGS84
-    wgs84 = QgsCoordinateReferenceSystem("EPSG:4326")
-    layer_crs = loaded_layer.crs()
-    transform = QgsCoordinateTransform(wgs84, layer_crs, qgis_project)
+    if isinstance(loaded_layer, ShapelyLayer):
+        # shapely point in the layer CRS
+        return shapely.points(*get_pyproj_transformer(loaded_layer.crs_string).transform(lon, lat))
+
+    # Transform from WGS84 to the layer CRS
+    transform = get_coordinate_transform("EPSG:4326", loaded_layer.crs())
     
     # Check if layer CRS matches project CRS
     # if loaded_layer.crs().authid() == qgis_project.crs().authid():
@@ -96,51 +328,385 @@ def to_project_geom(loaded_layer, lon, lat):
     point_proj = transform.transform(point)
     return QgsGeometry.fromPointXY(point_proj)
 
-# Geocode the address using Nominatim or Google Geocoding API
+# region Batch Reprojection
 
-def geocode_address(address):
-    """Try geopy.Nominatim if available; otherwise use direct Nominatim HTTP API."""
+# pyproj transformer from WGS84 to dest_crs (authority id or WKT), built once per CRS
+def get_pyproj_transformer(dest_crs):
+    if dest_crs not in PYPROJ_TRANSFORMERS:
+        PYPROJ_TRANSFORMERS[dest_crs] = Transformer.from_crs("EPSG:4326", dest_crs, always_xy=True)
+    return PYPROJ_TRANSFORMERS[dest_crs]
+
+# Reproject many WGS84 points at once
+def reproject_points(points, dest_crs):
+    """
+    points is a list of (lat, lon); returns (xs, ys) in dest_crs as compact arrays
+    (NumPy arrays through pyproj when installed, otherwise array('d') through the cached QGIS transform).
+    """
+    if Transformer is not None and np is not None:
+        lons = np.fromiter((lon for _, lon in points), dtype=float, count=len(points))
+        lats = np.fromiter((lat for lat, _ in points), dtype=float, count=len(points))
+        return get_pyproj_transformer(dest_crs.authid() or dest_crs.toWkt()).transform(lons, lats)
+
+    transform = get_coordinate_transform("EPSG:4326", dest_crs)
+    xs, ys = array('d'), array('d')
+    for lat, lon in points:
+        point_proj = transform.transform(QgsPointXY(lon, lat))
+        xs.append(point_proj.x())
+        ys.append(point_proj.y())
+    return xs, ys
+
+def reproject_points_to_layers(points, layers):
+    """Returns {layer id: (xs, ys)}, reprojecting the points once per distinct layer CRS."""
+    by_crs = {}
+    projected_points = {}
+    for layer in layers:
+        crs = layer.crs()
+        crs_key = crs.authid() or crs.toWkt()
+        if crs_key not in by_crs:
+            by_crs[crs_key] = reproject_points(points, crs)
+        projected_points[layer.id()] = by_crs[crs_key]
+    return projected_points
+
+def projected_point(projected_points, layer, point_index):
+    """(x, y) of a point from reproject_points_to_layers() in the layer CRS, or None if it was not reprojected."""
+    if layer.id() not in projected_points:
+        return None
+    xs, ys = projected_points[layer.id()]
+    return float(xs[point_index]), float(ys[point_index])
+
+#endregion Batch Reprojection
+
+# region Geocode Cache
+
+_geocode_cache_conn = None
+_geocode_cache_lock = threading.Lock()
+
+# Unit / apartment designators dropped from cache keys (e.g. "Apt 906", "Suite B", "# 12")
+UNIT_SUFFIX_PATTERN = re.compile(r"(\b(APT|APARTMENT|UNIT|STE|SUITE|RM|ROOM|BLDG)\b\.?|#)\s*([A-Z]?\d[A-Z0-9-]*|[A-Z])\b")
+ZIP_PATTERN = re.compile(r"\b(\d{5})(-?\d{4})?\b")
+
+def normalize_address(address):
+    """Cache key and geocoder query for an address: upper case, no unit suffix or punctuation, 5-digit ZIP, single spaces."""
+    key = address.upper()
+    key = UNIT_SUFFIX_PATTERN.sub(" ", key)
+    key = ZIP_PATTERN.sub(r"\1", key)
+    key = re.sub(r"[.,]", " ", key)
+    key = re.sub(r"\s+", " ", key)
+    return key.strip()
+
+def get_geocode_cache():
+    global _geocode_cache_conn
+    if _geocode_cache_conn is None:
+        # Worker processes share the cache file, so wait for their write locks instead of failing
+        _geocode_cache_conn = sqlite3.connect(GEOCODE_CACHE_PATH, timeout=30, check_same_thread=False)
+        _geocode_cache_conn.execute("""CREATE TABLE IF NOT EXISTS geocode_cache (
+                                           address_key TEXT NOT NULL,
+                                           provider TEXT NOT NULL,
+                                           lat REAL,
+                                           lon REAL,
+                                           created_at REAL NOT NULL,
+                                           expires_at REAL NOT NULL,
+                                           PRIMARY KEY (address_key, provider))""")
+        _geocode_cache_conn.commit()
+    return _geocode_cache_conn
+
+def geocode_cache_get(address, provider):
+    """Returns (hit, lat, lon); a hit with lat/lon of None is a cached "not found" answer."""
+    with _geocode_cache_lock:
+        row = get_geocode_cache().execute(
+            "SELECT lat, lon FROM geocode_cache WHERE address_key = ? AND provider = ? AND expires_at > ?",
+            (normalize_address(address), provider, time.time())).fetchone()
+        if row is None:
+            GEOCODE_CACHE_STATS["misses"] += 1
+            return False, None, None
+        GEOCODE_CACHE_STATS["hits"] += 1
+    return True, row[0], row[1]
+
+def geocode_cache_put(address, provider, lat, lon):
+    now = time.time()
+    ttl = GEOCODE_CACHE_NEGATIVE_TTL if lat is None or lon is None else GEOCODE_CACHE_TTL
+    with _geocode_cache_lock:
+        conn = get_geocode_cache()
+        conn.execute("INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?, ?)",
+                     (normalize_address(address), provider, lat, lon, now, now + ttl))
+        conn.commit()
+
+#endregion Geocode Cache
+
+# region Geocode Rate Limit
+
+# Earliest time the next request to each provider may be sent. Shared values, so that the
+# worker processes of a parallel run (see init_pipeline_worker()) stay within one limit together.
+_geocode_rate_slots = {provider: multiprocessing.Value('d', 0.0) for provider in GEOCODE_MIN_INTERVAL}
+# Requests in flight to each provider, shared the same way so GEOCODE_MAX_IN_FLIGHT holds for the whole pool
+_geocode_in_flight = {provider: multiprocessing.BoundedSemaphore(limit) for provider, limit in GEOCODE_MAX_IN_FLIGHT.items()}
+
+def wait_for_geocode_slot(provider):
+    """
+    Block until provider's token bucket has a token: one every GEOCODE_MIN_INTERVAL, at most GEOCODE_BURST saved up.
+    The slot holds the time the bucket is full again, so taking a token is one compare-and-add (GCRA).
+    """
+    slot = _geocode_rate_slots[provider]
+    interval = GEOCODE_MIN_INTERVAL[provider]
+    with slot.get_lock():
+        now = time.time()
+        wait = slot.value - now - (GEOCODE_BURST[provider] - 1) * interval
+        slot.value = max(now, slot.value) + interval
+    record_stage(f"geocode_wait:{provider}", max(wait, 0))
+    if wait > 0:
+        time.sleep(wait)
+
+#endregion Geocode Rate Limit
+
+# region Metrics
+
+# Latency histogram per stage and count per event, both named "kind:target" (e.g. "geocode:nominatim",
+# "arcgis_retries:<service url>"). Exported at the end of a run with --metrics, or from the lookup service.
+STAGE_METRICS = {}
+EVENT_COUNTERS = {}
+_metrics_lock = threading.Lock()
+
+def configure_logging(level=None):
+    logging.basicConfig(level=level or LOG_LEVEL, format="%(message)s")
+
+def new_stage_metric():
+    # bucket i counts the durations <= METRIC_BUCKETS[i] (and > the previous bound), the last one the rest
+    return {"count": 0, "sum": 0.0, "buckets": [0] * (len(METRIC_BUCKETS) + 1)}
+
+def record_stage(stage, seconds):
+    with _metrics_lock:
+        metric = STAGE_METRICS.setdefault(stage, new_stage_metric())
+        metric["count"] += 1
+        metric["sum"] += seconds
+        metric["buckets"][bisect.bisect_left(METRIC_BUCKETS, seconds)] += 1
+
+@contextmanager
+def timed_stage(stage):
+    """Records the duration of the block under stage; a block that raises also counts a "<kind>_failures:<target>" event."""
+    start = time.perf_counter()
     try:
-        # try geopy Nominatim first
-        geolocator = Nominatim(user_agent="qgis_parcel_lookup")
-        loc = geolocator.geocode(address, timeout=10)
-        if loc:
-            return float(loc.latitude), float(loc.longitude)
+        yield
     except Exception:
-        print("Geopy Nominatim failed, trying direct HTTP API...")
-        pass
+        kind, _, target = stage.partition(":")
+        count_event(f"{kind}_failures:{target}")
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start)
 
-    # fallback: direct HTTP call to Nominatim
-    try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {"q": address, "format": "json", "limit": 1}
-        response = requests.get(url, params=params, headers={"User-Agent": "QGIS Parcel Lookup"}, timeout=10)
-        response.raise_for_status()
-        geo_data = response.json()
+def count_event(event, count=1):
+    with _metrics_lock:
+        EVENT_COUNTERS[event] = EVENT_COUNTERS.get(event, 0) + count
 
-        if geo_data:
-            lat = float(geo_data[0]["lat"])
-            lon = float(geo_data[0]["lon"])
+def drain_metrics():
+    """Returns the metrics recorded so far and resets them, so a worker process sends each measurement once."""
+    with _metrics_lock:
+        metrics = {"stages": dict(STAGE_METRICS), "events": dict(EVENT_COUNTERS)}
+        STAGE_METRICS.clear()
+        EVENT_COUNTERS.clear()
+    return metrics
 
-            return lat, lon
-           
-    except Exception as e:
-        print("Direct Nominatim HTTP API failed.")
-    
-    return None, None
+# Add the metrics of a worker process (drain_metrics()) to this process's
+def merge_metrics(metrics):
+    with _metrics_lock:
+        for stage, metric in metrics["stages"].items():
+            merged = STAGE_METRICS.setdefault(stage, new_stage_metric())
+            merged["count"] += metric["count"]
+            merged["sum"] += metric["sum"]
+            merged["buckets"] = [total + count for total, count in zip(merged["buckets"], metric["buckets"])]
+        for event, count in metrics["events"].items():
+            EVENT_COUNTERS[event] = EVENT_COUNTERS.get(event, 0) + count
+
+def metrics_report():
+    """Stage histograms and event counters, with the geocode cache and dedup counters folded in as events."""
+    with _metrics_lock:
+        stages = {stage: {"count": metric["count"],
+                          "sum_seconds": round(metric["sum"], 6),
+                          "mean_ms": round(1000 * metric["sum"] / metric["count"], 3),
+                          "buckets": dict(zip([str(bound) for bound in METRIC_BUCKETS] + ["+Inf"], metric["buckets"]))}
+                  for stage, metric in sorted(STAGE_METRICS.items())}
+        events = dict(EVENT_COUNTERS)
+    events.update({f"geocode_cache:{name}": count for name, count in GEOCODE_CACHE_STATS.items()})
+    events.update({f"dedup:{name}": count for name, count in DEDUP_STATS.items()})
+    return {"stages": stages, "events": dict(sorted(events.items()))}
+
+def prometheus_labels(name, **labels):
+    escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for key, value in labels.items()}
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+# Same metrics in the Prometheus text exposition format
+def metrics_as_prometheus():
+    report = metrics_report()
+    lines = ["# HELP bin_pipeline_stage_seconds Duration of each pipeline stage.",
+             "# TYPE bin_pipeline_stage_seconds histogram"]
+    for stage, metric in report["stages"].items():
+        kind, _, target = stage.partition(":")
+        cumulative = 0
+        for bound, count in metric["buckets"].items():
+            cumulative += count
+            lines.append(f"{prometheus_labels('bin_pipeline_stage_seconds_bucket', stage=kind, target=target, le=bound)} {cumulative}")
+        lines.append(f"{prometheus_labels('bin_pipeline_stage_seconds_sum', stage=kind, target=target)} {metric['sum_seconds']}")
+        lines.append(f"{prometheus_labels('bin_pipeline_stage_seconds_count', stage=kind, target=target)} {metric['count']}")
+    lines += ["# HELP bin_pipeline_events_total Cache hits, retries, failures and other pipeline events.",
+              "# TYPE bin_pipeline_events_total counter"]
+    for event, count in report["events"].items():
+        kind, _, target = event.partition(":")
+        lines.append(f"{prometheus_labels('bin_pipeline_events_total', event=kind, target=target)} {count}")
+    return "\n".join(lines) + "\n"
+
+# Stages ordered by their total time, to see where a run spends it
+def log_stage_summary():
+    stages = metrics_report()["stages"]
+    if not stages:
+        return
+    log.info(f"{'Stage':<60}{'Count':>10}{'Total (s)':>12}{'Mean (ms)':>12}")
+    for stage, metric in sorted(stages.items(), key=lambda item: item[1]["sum_seconds"], reverse=True):
+        log.info(f"{stage[:59]:<60}{metric['count']:>10}{metric['sum_seconds']:>12.2f}{metric['mean_ms']:>12.2f}")
+    chunks = stages.get("pipeline:chunk")
+    if chunks and chunks["sum_seconds"]:
+        # Summed over the worker processes of a parallel run, so this is the throughput of one worker
+        rows = metrics_report()["events"].get("pipeline:rows", 0)
+        log.info(f"Pipeline throughput: {rows / chunks['sum_seconds']:.1f} rows/s per worker")
+
+# Write the metrics report: Prometheus text for a .prom / .txt path, JSON otherwise
+def export_metrics(path):
+    with open(path, "w", encoding="utf-8") as metrics_file:
+        if path.endswith((".prom", ".txt")):
+            metrics_file.write(metrics_as_prometheus())
+        else:
+            json.dump(metrics_report(), metrics_file, indent=2)
+    log.info(f"Metrics written to {path}")
 
-# Example function for Google Geocoding API (if needed)
-def geocode_google(address):
+#endregion Metrics
+
+# region Geocoding Engine
+
+_geocode_sessions = {}
+_geocode_executor = None
+_geocode_client_lock = threading.Lock()
+# Addresses routed to each provider and not answered yet, see geocode_expected_seconds()
+GEOCODE_QUEUED = {provider: 0 for provider in GEOCODE_COST}
+# Moving average request latency (seconds) of each provider; kept apart from STAGE_METRICS, which drain_metrics() empties
+GEOCODE_LATENCY = {}
+
+# One pooled HTTP session per provider, sized for its requests in flight
+def get_geocode_session(provider):
+    with _geocode_client_lock:
+        if provider not in _geocode_sessions:
+            adapter = HTTPAdapter(pool_maxsize=GEOCODE_MAX_IN_FLIGHT[provider])
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _geocode_sessions[provider] = session
+        return _geocode_sessions[provider]
+
+def get_geocode_executor():
+    global _geocode_executor
+    with _geocode_client_lock:
+        if _geocode_executor is None:
+            _geocode_executor = ThreadPoolExecutor(max_workers=sum(GEOCODE_MAX_IN_FLIGHT.values()), thread_name_prefix="geocode")
+        return _geocode_executor
+
+# Nominatim /search API, served by nominatim.openstreetmap.org or the local geocoder
+def request_nominatim(provider, address):
+    url = LOCAL_GEOCODER_URL if provider == "local" else f"{NOMINATIM_SCHEME}://{NOMINATIM_DOMAIN}/search"
+    params = {"q": address, "format": "json", "limit": 1}
+    response = get_geocode_session(provider).get(url, params=params, headers={"User-Agent": "QGIS Parcel Lookup"},
+                                                 timeout=GEOCODE_REQUEST_TIMEOUT)
+    response.raise_for_status()
+    geo_data = response.json()
+    if not geo_data:
+        return None, None
+    return float(geo_data[0]["lat"]), float(geo_data[0]["lon"])
+
+def request_google(address):
     api_key = "xxxx"
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
     params = {'address': address, 'key': api_key}
-    r = requests.get(url, params=params)
+    r = get_geocode_session("google").get(GOOGLE_GEOCODE_URL, params=params, timeout=GEOCODE_REQUEST_TIMEOUT)
     r.raise_for_status()
     data = r.json()
-    if data['status'] != 'OK':
+    if data['status'] not in ('OK', 'ZERO_RESULTS'):
         raise ValueError(data['status'])
-    result = data['results'][0]
-    return result['geometry']['location']['lat'], result['geometry']['location']['lng']
+    if data['status'] == 'ZERO_RESULTS':
+        return None, None
+    location = data['results'][0]['geometry']['location']
+    return location['lat'], location['lng']
+
+# Geocode with one provider: its cache entry, else one request within its in-flight limit and token bucket
+def geocode_with_provider(provider, address):
+    """Returns (lat, lon), or (None, None) when the provider has no match; raises when the request fails."""
+    hit, lat, lon = geocode_cache_get(address, provider)
+    if hit:
+        return lat, lon
+
+    # The provider gets the cache key itself, so the addresses sharing an entry (e.g. other units) share one answer
+    query = normalize_address(address)
+    with _geocode_in_flight[provider]:
+        wait_for_geocode_slot(provider)
+        start = time.perf_counter()
+        try:
+            with timed_stage(f"geocode:{provider}"):
+                lat, lon = request_google(query) if provider == "google" else request_nominatim(provider, query)
+        finally:
+            # Failed requests count too: a provider timing out is a slow provider
+            update_geocode_latency(provider, time.perf_counter() - start)
+    # A "not found" answer is remembered for a shorter time
+    geocode_cache_put(address, provider, lat, lon)
+    return lat, lon
+
+def update_geocode_latency(provider, seconds):
+    previous = GEOCODE_LATENCY.get(provider)
+    GEOCODE_LATENCY[provider] = seconds if previous is None else previous + GEOCODE_LATENCY_SMOOTHING * (seconds - previous)
+
+# Providers in the order they are tried: cheapest first, then fastest so far
+def geocode_providers():
+    providers = [provider for provider in GEOCODE_COST if provider != "local" or LOCAL_GEOCODER_URL]
+    return sorted(providers, key=lambda provider: (GEOCODE_COST[provider], GEOCODE_LATENCY.get(provider, 0.0)))
+
+def geocode_expected_seconds(provider):
+    """Rough time an address routed to provider now would take: the queue ahead of it at the provider's throughput, plus one request."""
+    latency = GEOCODE_LATENCY.get(provider, 0.0)
+    per_request = max(GEOCODE_MIN_INTERVAL[provider], latency / GEOCODE_MAX_IN_FLIGHT[provider])
+    return GEOCODE_QUEUED[provider] * per_request + latency
+
+# Pick the provider for one address: the cheapest one, or with GEOCODE_LATENCY_BUDGET the cheapest that is fast enough
+def route_geocode(providers):
+    """Returns the providers reordered so the chosen one comes first; the others stay as fallbacks in cost order."""
+    if GEOCODE_LATENCY_BUDGET is None:
+        return providers
+    for provider in providers:
+        if geocode_expected_seconds(provider) <= GEOCODE_LATENCY_BUDGET:
+            if provider != providers[0]:
+                count_event(f"geocode_rerouted:{provider}")
+            return [provider] + [other for other in providers if other != provider]
+    return providers
+
+# Geocode the address with the routed provider, falling back to the next ones while it is not found
+def geocode_address(address):
+    """Returns (lat, lon), or (None, None) when no provider found the address."""
+    providers = route_geocode(geocode_providers())
+    for attempt, provider in enumerate(providers):
+        if attempt:
+            log.debug(f"{providers[attempt - 1]} geocoding failed, trying {provider}...")
+        with _geocode_client_lock:
+            GEOCODE_QUEUED[provider] += 1
+        try:
+            lat, lon = geocode_with_provider(provider, address)
+        except Exception as e:
+            log.warning(f"{provider} geocoding failed for {address}: {e}")
+            continue
+        finally:
+            with _geocode_client_lock:
+                GEOCODE_QUEUED[provider] -= 1
+        if lat is not None and lon is not None:
+            return lat, lon
+    return None, None
+
+# Geocode many addresses at once: each provider runs as many requests in flight as it allows, at its token bucket rate
+def geocode_addresses(addresses):
+    """Returns [(lat, lon)] in the order of addresses, (None, None) where no provider found the address."""
+    return list(get_geocode_executor().map(geocode_address, addresses))
+
+#endregion Geocoding Engine
 
 #endregion General Helper Functions
 
@@ -158,13 +724,99 @@ def extract_value_from_attributes(attributes, possible_keys):
 
     return attribute_value
 
+# Extract the values of several attributes from one attributes dict in a single pass
+def extract_values_from_attributes(attributes, attribute_keys):
+    """attribute_keys maps an attribute name to its possible keys; returns {attribute name: value} for the values found."""
+    key_lookup = {}
+    for name, possible_keys in attribute_keys.items():
+        for key in possible_keys:
+            key_lookup.setdefault(key.lower(), name)
+
+    values = {}
+    for attr_name, attr_value in attributes.items():
+        name = key_lookup.get(attr_name.lower())
+        if name is not None and name not in values and not is_missing_value(attr_value):
+            values[name] = attr_value
+
+    return values
+
+# region ARC Services Client
+
+_arc_session = None
+_arc_executor = None
+_arc_client_lock = threading.Lock()
+_arc_host_semaphores = {}
+# Response format ("geojson" or "json") that each service answered with, so it is only probed once
+ARC_SERVICE_FORMATS = {}
+
+# Pooled HTTP session with retry/backoff shared by every ArcGIS request
+def get_arc_session():
+    global _arc_session
+    with _arc_client_lock:
+        if _arc_session is None:
+            # A POSTed /query only reads, so it is retried like a GET
+            retry = Retry(total=ARC_MAX_RETRIES, backoff_factor=ARC_RETRY_BACKOFF,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=["GET", "POST"])
+            adapter = HTTPAdapter(pool_connections=len(ARC_SERVICES), pool_maxsize=ARC_MAX_CONNECTIONS_PER_HOST, max_retries=retry)
+            _arc_session = requests.Session()
+            _arc_session.mount("https://", adapter)
+            _arc_session.mount("http://", adapter)
+        return _arc_session
+
+def get_arc_executor():
+    global _arc_executor
+    with _arc_client_lock:
+        if _arc_executor is None:
+            _arc_executor = ThreadPoolExecutor(max_workers=ARC_MAX_WORKERS, thread_name_prefix="arcgis")
+        return _arc_executor
+
+def get_host_semaphore(url):
+    host = urlparse(url).netloc
+    with _arc_client_lock:
+        if host not in _arc_host_semaphores:
+            _arc_host_semaphores[host] = threading.BoundedSemaphore(ARC_MAX_CONNECTIONS_PER_HOST)
+        return _arc_host_semaphores[host]
+
+# GET (or POST as a form, for parameters too long for a url) an ArcGIS REST endpoint within the per-host concurrency limit
+def arcgis_request(url, params, method="GET"):
+    """Returns the decoded JSON answer, or None if the request or the service failed."""
+    # Metrics are kept per service, for its /query and metadata requests together
+    service_url = url[:-len("/query")] if url.endswith("/query") else url
+    try:
+        with get_host_semaphore(url), timed_stage(f"arcgis:{service_url}"):
+            if method == "POST":
+                r = get_arc_session().post(url, data=params, timeout=ARC_REQUEST_TIMEOUT)
+            else:
+                r = get_arc_session().get(url, params=params, timeout=ARC_REQUEST_TIMEOUT)
+            # Retries done by the session's Retry policy before this answer
+            retries = getattr(r.raw, "retries", None)
+            if retries is not None and retries.history:
+                count_event(f"arcgis_retries:{service_url}", len(retries.history))
+            r.raise_for_status()
+            data = r.json()
+    except Exception as e:
+        log.warning(f"Service query failed: {url} {e}")
+        return None
+    # ArcGIS reports errors (e.g. an unsupported f=geojson) as HTTP 200 with an 'error' body
+    if not isinstance(data, dict) or "error" in data:
+        count_event(f"arcgis_failures:{service_url}")
+        log.warning(f"Service query failed: {url} {data.get('error') if isinstance(data, dict) else data}")
+        return None
+    return data
+
+#endregion ARC Services Client
+
+# Service response of a point whose query failed, as opposed to None for a point the service has no feature for
+ARC_QUERY_FAILED = {"attributes": {}, "geometry": None, "raw": None, "failed": True}
+
 # Query an ArcGIS/FeatureServer/MapServer layer for features
-def query_arcgis_service(service_url, lat, lon, try_geojson=True):
+def query_arcgis_service(service_url, lat, lon, try_geojson=None):
     """
     Query an ArcGIS/FeatureServer/MapServer layer for features intersecting (lon,lat).
-    Returns a dict with 'attributes' and optionally 'geometry' (GeoJSON geometry).
+    Returns a dict with 'attributes' and optionally 'geometry' (GeoJSON geometry), None if no feature intersects the point,
+    or ARC_QUERY_FAILED if the service failed.
+    With try_geojson=None the format is probed once per service (geojson, then json) and remembered.
     """
-    query_url = service_url.rstrip("/") + "/query"
     params = {
         "geometry": f"{lon},{lat}",
         "geometryType": "esriGeometryPoint",
@@ -172,30 +824,343 @@ def query_arcgis_service(service_url, lat, lon, try_geojson=True):
         "spatialRel": "esriSpatialRelIntersects",
         "outFields": "*",
         "returnGeometry": "true",
-        "f": "geojson" if try_geojson else "json",
     }
 
-    try:
-        r = requests.get(query_url, params=params, timeout=15)
-        r.raise_for_status()
-        data = r.json()
-        # ArcGIS Services sometimes return GeoJSON when f=geojson or a JSON with 'features'
-        if not data:
-            return None
-        # If GeoJSON-style
-        if "features" in data and len(data["features"]) > 0:
-            feat = data["features"][0]
-            return {"attributes": feat.get("properties", {}), "geometry": feat.get("geometry", None), "raw": data}
-        # If ArcGIS JSON (not geojson) and has 'features' list
-        if "features" in data and len(data["features"]) > 0:
-            feat = data["features"][0]
-            return {"attributes": feat.get("attributes", {}), "geometry": feat.get("geometry", None), "raw": data}
-    except Exception as e:
-        # Most services support these simple queries; skip if one fails.
-        print("Service query failed:", service_url, e)
+    data = arcgis_query(service_url, params, try_geojson)
+    if data is None:
+        return ARC_QUERY_FAILED
+    if len(data["features"]) == 0:
         return None
+
+    feat = data["features"][0]
+    return {"attributes": feature_attributes(feat), "geometry": feat.get("geometry", None), "raw": data}
+
+# Run a /query request against a service in its remembered (or probed) response format
+def arcgis_query(service_url, params, try_geojson=None, method="GET"):
+    """Returns the decoded answer (always with a 'features' list), or None if no format worked."""
+    query_url = service_url.rstrip("/") + "/query"
+    if try_geojson is None:
+        known_format = ARC_SERVICE_FORMATS.get(service_url)
+        formats = [known_format] if known_format else ["geojson", "json"]
+    else:
+        formats = ["geojson" if try_geojson else "json"]
+
+    for response_format in formats:
+        data = arcgis_request(query_url, dict(params, f=response_format), method)
+        # ArcGIS Services sometimes return GeoJSON when f=geojson or a JSON with 'features'
+        if data and "features" in data:
+            ARC_SERVICE_FORMATS.setdefault(service_url, response_format)
+            return data
     return None
 
+def feature_attributes(feature):
+    # GeoJSON features carry 'properties', ArcGIS JSON features carry 'attributes'
+    attributes = feature.get("properties") if "properties" in feature else feature.get("attributes", {})
+    return attributes or {}
+
+# Query every service for one point concurrently
+def query_arcgis_services(lat, lon, services=ARC_SERVICES):
+    """Returns the query_arcgis_service() responses in the order of services."""
+    futures = [get_arc_executor().submit(query_arcgis_service, svc, lat, lon) for svc in services]
+    return [future.result() for future in futures]
+
+# Query every service for many points concurrently
+def query_arcgis_services_bulk(points, services=ARC_SERVICES):
+    """points is a list of (lat, lon); returns one list of service responses per point, in input order."""
+    executor = get_arc_executor()
+    futures = [[executor.submit(query_arcgis_service, svc, lat, lon) for svc in services] for lat, lon in points]
+    return [[future.result() for future in point_futures] for point_futures in futures]
+
+# region ARC Services Batch Queries
+
+# Layer metadata (field names, pagination support) of each service, fetched once
+ARC_SERVICE_INFO = {}
+
+def get_arc_service_info(service_url, refresh=False):
+    """Returns the layer's fields, pagination support, max record count, object id / edit date fields and last edit date."""
+    if refresh or service_url not in ARC_SERVICE_INFO:
+        data = arcgis_request(service_url.rstrip("/"), {"f": "json"}) or {}
+        ARC_SERVICE_INFO[service_url] = {
+            "fields": [field["name"] for field in data.get("fields") or [] if "name" in field],
+            "supports_pagination": bool((data.get("advancedQueryCapabilities") or {}).get("supportsPagination")),
+            "max_record_count": data.get("maxRecordCount") or ARC_BATCH_PAGE_SIZE,
+            "object_id_field": data.get("objectIdField") or next((field["name"] for field in data.get("fields") or []
+                                                                   if field.get("type") == "esriFieldTypeOID"), None),
+            "edit_date_field": (data.get("editFieldsInfo") or {}).get("editDateField"),
+            "last_edit_date": (data.get("editingInfo") or {}).get("lastEditDate"),
+        }
+    return ARC_SERVICE_INFO[service_url]
+
+# outFields trimmed to the fields that can hold parcel_id / stories / build_id
+def get_arc_out_fields(service_url):
+    wanted_keys = {key.lower() for keys in ATTRIBUTE_KEYS.values() for key in keys}
+    fields = [name for name in get_arc_service_info(service_url)["fields"] if name.lower() in wanted_keys]
+    return ",".join(fields) if fields else "*"
+
+# Group point indexes into square tiles of ARC_BATCH_TILE_SIZE degrees, split into chunks of ARC_BATCH_MAX_POINTS
+def group_points_into_tiles(points, tile_size=ARC_BATCH_TILE_SIZE, max_points=ARC_BATCH_MAX_POINTS):
+    """points is a list of (lat, lon); returns a list of lists of indexes into points."""
+    tiles = {}
+    for i, (lat, lon) in enumerate(points):
+        tiles.setdefault((int(lon // tile_size), int(lat // tile_size)), []).append(i)
+
+    batches = []
+    for tile in tiles.values():
+        for start in range(0, len(tile), max_points):
+            batches.append(tile[start:start + max_points])
+    return batches
+
+# Polygon rings of a GeoJSON or ArcGIS JSON geometry
+def geometry_rings(geometry):
+    if not geometry:
+        return []
+    if "rings" in geometry:
+        return geometry["rings"]
+    if geometry.get("type") == "Polygon":
+        return geometry["coordinates"]
+    if geometry.get("type") == "MultiPolygon":
+        return [ring for polygon in geometry["coordinates"] for ring in polygon]
+    return []
+
+# Even-odd point-in-polygon test over every ring (holes included)
+def point_in_rings(x, y, rings):
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+    return inside
+
+# Query one service for every feature intersecting a batch of points, following resultOffset pagination
+def query_arcgis_service_points(service_url, batch_points):
+    """batch_points is a list of (lat, lon); returns the matching features and whether every page was fetched."""
+    params = {
+        "inSR": "4326",
+        "outSR": "4326",
+        "spatialRel": "esriSpatialRelIntersects",
+        "outFields": get_arc_out_fields(service_url),
+    }
+    if len(batch_points) == 1:
+        lat, lon = batch_points[0]
+        # A single point needs no local assignment, so skip the geometry
+        params.update({"geometry": f"{lon},{lat}", "geometryType": "esriGeometryPoint", "returnGeometry": "false"})
+        method = "GET"
+    else:
+        multipoint = {"points": [[lon, lat] for lat, lon in batch_points], "spatialReference": {"wkid": 4326}}
+        params.update({"geometry": json.dumps(multipoint, separators=(",", ":")), "geometryType": "esriGeometryMultipoint", "returnGeometry": "true"})
+        # The multipoint is too long for a url that proxies and servers accept
+        method = "POST"
+
+    features = []
+    for data in arcgis_query_pages(service_url, params, method):
+        if data is None:
+            return features, False
+        features.extend(data["features"])
+    return features, True
+
+# Run a /query request page by page, following resultOffset pagination where the service supports it
+def arcgis_query_pages(service_url, params, method="GET"):
+    """Yields each decoded page; yields None and stops if a page fails."""
+    service_info = get_arc_service_info(service_url)
+    page_size = min(ARC_BATCH_PAGE_SIZE, service_info["max_record_count"])
+    offset = 0
+    while True:
+        page_params = dict(params)
+        if service_info["supports_pagination"]:
+            page_params.update({"resultOffset": offset, "resultRecordCount": page_size})
+        data = arcgis_query(service_url, page_params, method=method)
+        yield data
+        if data is None:
+            return
+        offset += len(data["features"])
+
+        exceeded = data.get("exceededTransferLimit") or (data.get("properties") or {}).get("exceededTransferLimit")
+        if not exceeded or not data["features"] or not service_info["supports_pagination"]:
+            return
+
+# Query every service once per tile of points and assign the returned polygons back to the points
+def query_arcgis_services_batch(points, services=ARC_SERVICES):
+    """points is a list of (lat, lon); returns one list of service responses per point, like query_arcgis_services_bulk()."""
+    responses = [[None] * len(services) for _ in points]
+    batches = group_points_into_tiles(points)
+    executor = get_arc_executor()
+
+    futures = {}
+    for s, svc in enumerate(services):
+        for batch in batches:
+            futures[(s, tuple(batch))] = executor.submit(query_arcgis_service_points, svc, [points[i] for i in batch])
+
+    for (s, batch), future in futures.items():
+        features, complete = future.result()
+        if len(batch) == 1:
+            if features:
+                feat = features[0]
+                responses[batch[0]][s] = {"attributes": feature_attributes(feat), "geometry": feat.get("geometry", None), "raw": None}
+            elif not complete:
+                responses[batch[0]][s] = ARC_QUERY_FAILED
+            continue
+        feature_rings = [(feat, geometry_rings(feat.get("geometry"))) for feat in features]
+        for i in batch:
+            lat, lon = points[i]
+            for feat, rings in feature_rings:
+                if point_in_rings(lon, lat, rings):
+                    responses[i][s] = {"attributes": feature_attributes(feat), "geometry": feat.get("geometry", None), "raw": None}
+                    break
+            else:
+                # The feature of this point may be on a page that failed
+                if not complete:
+                    responses[i][s] = ARC_QUERY_FAILED
+    return responses
+
+#endregion ARC Services Batch Queries
+
+# region ARC Services Mirror
+
+# Last synced state of a mirror layer, stored in the GeoPackage itself
+def get_mirror_state(gpkg_path, layer_name):
+    if not os.path.exists(gpkg_path):
+        return None
+    conn = sqlite3.connect(gpkg_path)
+    try:
+        row = conn.execute("SELECT service_url, last_edit_date, synced_at, feature_count FROM arc_mirror_state WHERE layer_name = ?",
+                           (layer_name,)).fetchone()
+    except sqlite3.OperationalError:
+        # No layer has been synced into this GeoPackage yet
+        row = None
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {"service_url": row[0], "last_edit_date": row[1], "synced_at": row[2], "feature_count": row[3]}
+
+def set_mirror_state(gpkg_path, layer_name, service_url, last_edit_date, feature_count):
+    conn = sqlite3.connect(gpkg_path)
+    try:
+        conn.execute("""CREATE TABLE IF NOT EXISTS arc_mirror_state (
+                            layer_name TEXT PRIMARY KEY,
+                            service_url TEXT NOT NULL,
+                            last_edit_date INTEGER,
+                            synced_at REAL NOT NULL,
+                            feature_count INTEGER)""")
+        conn.execute("INSERT OR REPLACE INTO arc_mirror_state VALUES (?, ?, ?, ?, ?)",
+                     (layer_name, service_url, last_edit_date, time.time(), feature_count))
+        conn.commit()
+    finally:
+        conn.close()
+
+def open_mirror_layer(gpkg_path, layer_name):
+    init_qgis()
+    return QgsVectorLayer(f"{gpkg_path}|layername={layer_name}", layer_name, 'ogr')
+
+# Write one decoded query page (GeoJSON or Esri JSON) into the mirror layer, reprojected to the project CRS
+def write_mirror_page(data, gpkg_path, layer_name, action):
+    qgis_project = init_qgis()
+    # OGR reads both GeoJSON and Esri JSON, so the page goes through a temporary file
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as page_file:
+        json.dump(data, page_file)
+    try:
+        page_layer = QgsVectorLayer(page_file.name, "arc_page", 'ogr')
+        if not page_layer.isValid():
+            raise RuntimeError(f"Could not read the {layer_name} page returned by the service")
+
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = "GPKG"
+        options.layerName = layer_name
+        options.actionOnExistingFile = action
+        options.ct = QgsCoordinateTransform(page_layer.crs(), qgis_project.crs(), qgis_project)
+        error = QgsVectorFileWriter.writeAsVectorFormatV3(page_layer, gpkg_path, qgis_project.transformContext(), options)
+        if error[0] != QgsVectorFileWriter.NoError:
+            raise RuntimeError(f"Writing {layer_name} to {gpkg_path} failed: {error[1]}")
+        del page_layer
+    finally:
+        os.remove(page_file.name)
+
+# Delete the mirror features with the given service object ids
+def delete_mirror_features(gpkg_path, layer_name, object_id_field, object_ids):
+    mirror_layer = open_mirror_layer(gpkg_path, layer_name)
+    object_ids = list(object_ids)
+    fids = []
+    for start in range(0, len(object_ids), 500):
+        id_list = ",".join(str(object_id) for object_id in object_ids[start:start + 500])
+        request = QgsFeatureRequest().setFilterExpression(f'"{object_id_field}" IN ({id_list})').setFlags(QgsFeatureRequest.NoGeometry)
+        fids.extend(feature.id() for feature in mirror_layer.getFeatures(request))
+    if fids:
+        mirror_layer.dataProvider().deleteFeatures(fids)
+    return len(fids)
+
+# Drop the mirror features that no longer exist on the service
+def delete_removed_mirror_features(service_url, gpkg_path, layer_name, object_id_field):
+    data = arcgis_request(service_url.rstrip("/") + "/query", {"where": "1=1", "returnIdsOnly": "true", "f": "json"})
+    if not data or "objectIds" not in data:
+        log.warning(f"Could not list the object ids of {service_url}, removed features are kept in the mirror.")
+        return 0
+    service_ids = set(data["objectIds"] or [])
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+    mirror_ids = {feature[object_id_field] for feature in open_mirror_layer(gpkg_path, layer_name).getFeatures(request)}
+    return delete_mirror_features(gpkg_path, layer_name, object_id_field, mirror_ids - service_ids)
+
+# Mirror one ArcGIS layer into the GeoPackage
+def sync_arc_mirror_layer(service_url, layer_name, gpkg_path):
+    """
+    Page through the service (resultOffset/resultRecordCount) and write its features into gpkg_path as layer_name.
+    Once a full copy exists, only the features edited since the recorded last-edit timestamp are downloaded again.
+    Returns True if the mirror layer is up to date.
+    """
+    init_qgis()
+    info = get_arc_service_info(service_url, refresh=True)
+    if not info["fields"]:
+        log.error(f"\033[91mCould not read the layer metadata of {service_url}\033[0m")
+        return False
+    if not info["supports_pagination"]:
+        log.warning(f"{service_url} does not support pagination, only the first {info['max_record_count']} features are mirrored per query.")
+
+    state = get_mirror_state(gpkg_path, layer_name)
+    if state and info["last_edit_date"] and state["last_edit_date"] == info["last_edit_date"]:
+        log.info(f"\033[92m{layer_name} mirror is up to date\033[0m")
+        return True
+
+    incremental = bool(state and state["last_edit_date"] and info["edit_date_field"] and info["object_id_field"]
+                       and open_mirror_layer(gpkg_path, layer_name).isValid())
+    params = {"outFields": "*", "returnGeometry": "true", "outSR": "4326"}
+    if incremental:
+        since = datetime.fromtimestamp(state["last_edit_date"] / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        params["where"] = f"{info['edit_date_field']} > timestamp '{since}'"
+        removed = delete_removed_mirror_features(service_url, gpkg_path, layer_name, info["object_id_field"])
+        log.info(f"Syncing {layer_name}: features edited since {since} UTC ({removed} removed)")
+        action = QgsVectorFileWriter.AppendToLayerNoNewFields
+    else:
+        params["where"] = "1=1"
+        log.info(f"Syncing {layer_name}: full download")
+        action = QgsVectorFileWriter.CreateOrOverwriteLayer if os.path.exists(gpkg_path) else QgsVectorFileWriter.CreateOrOverwriteFile
+
+    feature_count = 0
+    with tqdm(unit="feat", ncols=100, desc=f"Syncing {layer_name}") as pbar:
+        for data in arcgis_query_pages(service_url, params):
+            if data is None:
+                log.error(f"\033[91mSync of {layer_name} failed, it will be retried on the next sync\033[0m")
+                return False
+            if not data["features"]:
+                continue
+            if incremental:
+                # Replace the stored copies of the edited features
+                page_ids = [feature_attributes(feat).get(info["object_id_field"]) for feat in data["features"]]
+                delete_mirror_features(gpkg_path, layer_name, info["object_id_field"], [i for i in page_ids if i is not None])
+            write_mirror_page(data, gpkg_path, layer_name, action)
+            action = QgsVectorFileWriter.AppendToLayerNoNewFields
+            feature_count += len(data["features"])
+            pbar.update(len(data["features"]))
+
+    set_mirror_state(gpkg_path, layer_name, service_url, info["last_edit_date"], feature_count)
+    log.info(f"\033[92m{layer_name} mirror synced: {feature_count} features written\033[0m")
+    return True
+
+def sync_arc_mirror(gpkg_path=None):
+    gpkg_path = gpkg_path or project_path + ARC_MIRROR_PATH
+    os.makedirs(os.path.dirname(gpkg_path), exist_ok=True)
+    return all([sync_arc_mirror_layer(svc, layer_name, gpkg_path) for layer_name, svc in ARC_MIRROR_LAYERS.items()])
+
+#endregion ARC Services Mirror
+
 #endregion ARC Services Helper
 
 # region QGIS Loaded Layer Helpers
@@ -204,27 +1169,65 @@ def query_arcgis_service(service_url, lat, lon, try_geojson=True):
 def find_attribute_value_via_laoded_layer(loaded_layer, lat, lon, attribute_name, attribute_value, possible_keys):
     """Find parcel ID and stories by spatial intersection."""
     
-    address_geom = to_project_geom(loaded_layer, lon, lat)
-     
-# We will be using the exact geometry for intersection. We could also use:  
-# 1. Rectangle for quick pre-filtering -> address_geom.boundingBox() 
-# 2. Turn a bounding box into a polygon geometry if required
-# bbox = address_geom.boundingBox()
-# bbox_polygon = QgsGeometry.fromRect(bbox)
-# 3. Buffer around point (e.g., 10 meters) if needed
-    search_buffer = address_geom.buffer(10, 5)  # 10 meters buffer
-
-    for feature in loaded_layer.getFeatures():
-        if feature.geometry().intersects(search_buffer):
-            #  parcel_id = feature["ParcelId"] if "ParcelId" in feature.fields().names() else feature.attribute("ParcelId")
-            attribute_value = extract_value_from_features(feature, possible_keys)
-            
-            if (attribute_value != None) and (attribute_value != '' or attribute_value != ' ' or attribute_value != "NULL" or attribute_value != "NaN"):
-                print(f"\033[92mFound {attribute_name} --> {attribute_value} in loaded layer: {loaded_layer}\033[0m")
-                break   
+    record = resolve_attributes_via_loaded_layer(loaded_layer, lat, lon, {attribute_name: possible_keys})
+    if record[attribute_name] != None:
+        attribute_value = record[attribute_name]
     
     return attribute_value
 
+# Resolve several attributes with a single intersection pass over the layer
+def resolve_attributes_via_loaded_layer(loaded_layer, lat, lon, attribute_keys, point_xy=None):
+    """
+    Returns one record {attribute name: value} with the first value found for each attribute.
+    point_xy is the point already reprojected to the layer CRS (see reproject_points()), if available.
+    """
+    if isinstance(loaded_layer, ShapelyLayer):
+        return resolve_attributes_via_shapely_layer(loaded_layer, lat, lon, attribute_keys, point_xy)
+
+    record = {name: None for name in attribute_keys}
+
+    if point_xy is not None:
+        address_geom = QgsGeometry.fromPointXY(QgsPointXY(*point_xy))
+    else:
+        address_geom = to_project_geom(loaded_layer, lon, lat)
+
+    # Best match first: each attribute comes from the nearest ranked feature that holds it
+    missing_keys = dict(attribute_keys)
+    for distance, feature in get_nearest_features(loaded_layer, address_geom):
+        for name, value in extract_values_from_feature(feature, missing_keys).items():
+            record[name] = value
+            record[name + "_match"] = describe_match(distance)
+            del missing_keys[name]
+            log.debug(f"\033[92mFound {name} --> {value} ({distance:.2f} away) in loaded layer: {loaded_layer}\033[0m")
+        if not missing_keys:
+            break
+    
+    return record
+
+# Rank the features around a point: the NEAREST_K nearest within NEAREST_MAX_DISTANCE, nearest first
+def get_nearest_features(loaded_layer, point_geom, k=NEAREST_K, max_distance=NEAREST_MAX_DISTANCE):
+    """
+    Returns [(distance, feature)], ties by feature id; distance 0 means the feature contains the point.
+    Uses the layer's spatial index when available; otherwise falls back to a full layer scan.
+    """
+    index = LAYER_INDEXES.get(loaded_layer.id())
+    if index is None:
+        candidates = loaded_layer.getFeatures()
+    else:
+        # The index stores the feature geometries, so its neighbours are ranked by true distance, not bounding box
+        candidate_ids = index.nearestNeighbor(point_geom, k, max_distance)
+        if not candidate_ids:
+            return []
+        candidates = loaded_layer.getFeatures(QgsFeatureRequest().setFilterFids(candidate_ids))
+
+    ranked = sorted((feature.geometry().distance(point_geom), feature.id(), feature) for feature in candidates
+                    if not feature.geometry().isNull())
+    return [(distance, feature) for distance, _, feature in ranked if distance <= max_distance][:k]
+
+# Match type and distance (layer units) of a value found at distance from the point
+def describe_match(distance):
+    return ("contains" if distance == 0 else "nearest", round(float(distance), 2))
+
 # Extract Values from Features
 def  extract_value_from_features(feature, possible_keys):
     attribute_value = None
@@ -240,222 +1243,1132 @@ def  extract_value_from_features(feature, possible_keys):
         
     return attribute_value
 
+# Extract the values of several attributes from one feature
+def extract_values_from_feature(feature, attribute_keys):
+    attributes = dict(zip(feature.fields().names(), feature.attributes()))
+    return extract_values_from_attributes(attributes, attribute_keys)
+
+# region Bulk Spatial Join
+
+# Array-backed copy of a loaded layer, built once: geometries in an STRtree plus one value column per attribute
+def get_bulk_layer(loaded_layer):
+    if loaded_layer.id() in BULK_LAYERS:
+        return BULK_LAYERS[loaded_layer.id()]
+    if isinstance(loaded_layer, ShapelyLayer):
+        # Already array-backed, only the value columns are needed
+        columns = {name: loaded_layer.value_column(keys) for name, keys in ATTRIBUTE_KEYS.items()}
+        BULK_LAYERS[loaded_layer.id()] = {"tree": loaded_layer.tree, "geometries": loaded_layer.geometries, "fids": loaded_layer.fids,
+                                          "values": {name: values for name, (values, _) in columns.items()},
+                                          "has_value": {name: has_value for name, (_, has_value) in columns.items()}}
+        return BULK_LAYERS[loaded_layer.id()]
+    if shapely is None or np is None:
+        raise RuntimeError("the bulk spatial join needs shapely 2 and numpy")
+
+    build_start = time.time()
+    fids, wkbs = [], []
+    columns = {name: [] for name in ATTRIBUTE_KEYS}
+    for feature in loaded_layer.getFeatures():
+        geometry = feature.geometry()
+        if geometry.isNull():
+            continue
+        fids.append(feature.id())
+        wkbs.append(bytes(geometry.asWkb()))
+        values = extract_values_from_feature(feature, ATTRIBUTE_KEYS)
+        for name in columns:
+            columns[name].append(values.get(name))
+
+    geometries = shapely.from_wkb(wkbs)
+    bulk_layer = {
+        "tree": shapely.STRtree(geometries),
+        "geometries": geometries,
+        "fids": np.asarray(fids, dtype=np.int64),
+        "values": {name: np.asarray(column + [None], dtype=object)[:-1] for name, column in columns.items()},
+    }
+    # Features holding a value for each attribute, so the join can skip the others without a Python loop
+    bulk_layer["has_value"] = {name: np.not_equal(column, None) for name, column in bulk_layer["values"].items()}
+    BULK_LAYERS[loaded_layer.id()] = bulk_layer
+    log.info(f'{loaded_layer.name()} bulk join arrays built in {time.time() - build_start:.2f}s')
+    return bulk_layer
+
+# Join many points with one layer in a single vectorized query
+def bulk_join_layer(loaded_layer, xs, ys, attribute_names, distance=NEAREST_MAX_DISTANCE, k=NEAREST_K):
+    """
+    xs / ys are point coordinates in the layer CRS. Returns ({attribute name: object array with one value per point},
+    {attribute name: float array with the distance of that value's feature, NaN if there is none}), ranking the
+    features of each point like the per-address lookup: the k nearest within distance, nearest first, ties by fid.
+    """
+    bulk_layer = get_bulk_layer(loaded_layer)
+    points = shapely.points(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+    point_idx, feature_idx = bulk_layer["tree"].query(points, predicate="dwithin", distance=distance)
+    distances = shapely.distance(bulk_layer["geometries"][feature_idx], points[point_idx])
+
+    # Rank the candidates of each point and keep its k nearest
+    order = np.lexsort((bulk_layer["fids"][feature_idx], distances, point_idx))
+    point_idx, feature_idx, distances = point_idx[order], feature_idx[order], distances[order]
+    _, group_starts, group_sizes = np.unique(point_idx, return_index=True, return_counts=True)
+    ranked = np.arange(len(point_idx)) - np.repeat(group_starts, group_sizes) < k
+    point_idx, feature_idx, distances = point_idx[ranked], feature_idx[ranked], distances[ranked]
+
+    joined = {}
+    joined_distances = {}
+    for name in attribute_names:
+        keep = bulk_layer["has_value"][name][feature_idx]
+        hit_points, hit_features, hit_distances = point_idx[keep], feature_idx[keep], distances[keep]
+        # Still in rank order, so the first hit per point is its best match
+        matched_points, first_hits = np.unique(hit_points, return_index=True)
+
+        values = np.full(len(points), None, dtype=object)
+        values[matched_points] = bulk_layer["values"][name][hit_features[first_hits]]
+        joined[name] = values
+        match_distances = np.full(len(points), np.nan)
+        match_distances[matched_points] = hit_distances[first_hits]
+        joined_distances[name] = match_distances
+    return joined, joined_distances
+
+def bulk_join_points(loaded_layers, projected_points, point_count):
+    """
+    Step 2.1 for every point of a chunk: returns one record per point, filled from the layers in order
+    like the per-address loop. projected_points comes from reproject_points_to_layers().
+    """
+    records = [{name: None for name in ATTRIBUTE_KEYS} for _ in range(point_count)]
+    for loaded_layer in loaded_layers:
+        if loaded_layer.id() not in projected_points:
+            raise RuntimeError(f"points were not reprojected to {loaded_layer.name()}")
+        xs, ys = projected_points[loaded_layer.id()]
+        # One measurement per chunk and layer
+        with timed_stage(f"bulk_join:{loaded_layer.name()}"):
+            layer_values, layer_distances = bulk_join_layer(loaded_layer, xs, ys, ATTRIBUTE_KEYS)
+        for name, values in layer_values.items():
+            for record, value, distance in zip(records, values, layer_distances[name]):
+                if record[name] is None and value is not None:
+                    record[name] = value
+                    record[name + "_match"] = describe_match(distance)
+    return records
+
+#endregion Bulk Spatial Join
+
+# region Shapely Geometry Backend
+
+# Layers loaded by the shapely backend, keyed by layer name
+SHAPELY_LAYERS = {}
+
+class ShapelyCrs:
+    """The parts of QgsCoordinateReferenceSystem the pipeline uses, for a ShapelyLayer."""
+
+    def __init__(self, crs_string):
+        self.crs_string = crs_string
+
+    def authid(self):
+        return self.crs_string if re.fullmatch(r"[A-Za-z]+:\d+", self.crs_string) else ""
+
+    def toWkt(self):
+        return self.crs_string
+
+class ShapelyLayer:
+    """
+    A shapefile / GeoPackage layer read with pyogrio into shapely geometries and an STRtree, with the parts of the
+    QgsVectorLayer interface the pipeline uses (id, name, crs, featureCount), for running without QGIS.
+    """
+
+    def __init__(self, layer_name, path):
+        if pyogrio is None or shapely is None or Transformer is None:
+            raise RuntimeError("the shapely backend needs pyogrio, shapely 2 and pyproj")
+        # Same "path|layername=name" syntax as the QGIS ogr provider
+        path, _, sublayer = path.partition("|layername=")
+        meta, fids, wkbs, field_data = pyogrio.raw.read(path, layer=sublayer or None, return_fids=True)
+
+        geometries = shapely.from_wkb(wkbs)
+        valid = ~shapely.is_missing(geometries)
+        self._name = layer_name
+        self.crs_string = meta["crs"] or "EPSG:2240"
+        self.fids = np.asarray(fids)[valid]
+        self.geometries = geometries[valid]
+        self.fields = list(meta["fields"])
+        self.field_data = [np.asarray(column)[valid] for column in field_data]
+        self.tree = shapely.STRtree(self.geometries)
+        self._value_columns = {}
+
+    def id(self):
+        return f"shapely:{self._name}"
+
+    def name(self):
+        return self._name
+
+    def crs(self):
+        return ShapelyCrs(self.crs_string)
+
+    def featureCount(self):
+        return len(self.fids)
+
+    def value_column(self, possible_keys):
+        """
+        (values, has_value) arrays with, per feature, the value of the first field matching possible_keys
+        that is not missing, like extract_values_from_attributes().
+        """
+        cache_key = tuple(possible_keys)
+        if cache_key not in self._value_columns:
+            wanted = {key.lower() for key in possible_keys}
+            values = np.full(len(self.fids), None, dtype=object)
+            for field_name, column in zip(self.fields, self.field_data):
+                if field_name.lower() not in wanted:
+                    continue
+                for i, value in enumerate(column.tolist()):
+                    # NaN marks a NULL numeric field
+                    if values[i] is None and not is_missing_value(value) and value == value:
+                        values[i] = value
+            self._value_columns[cache_key] = (values, np.not_equal(values, None))
+        return self._value_columns[cache_key]
+
+    def __repr__(self):
+        return f"<ShapelyLayer {self._name} ({self.featureCount()} features)>"
+
+def load_shapely_layer(layer_name, path):
+    try:
+        layer = ShapelyLayer(layer_name, path)
+    except Exception as e:
+        log.error(f'{layer_name} layer failed to load ! {e}')
+        return None
+    SHAPELY_LAYERS[layer_name] = layer
+    log.info(f'{layer_name} layer loaded successfully!')
+    return layer
+
+# Same lookup as the QGIS path: the nearest of the ranked features (see get_nearest_features()) that holds each attribute
+def resolve_attributes_via_shapely_layer(loaded_layer, lat, lon, attribute_keys, point_xy=None):
+    point = shapely.points(*point_xy) if point_xy is not None else to_project_geom(loaded_layer, lon, lat)
+    candidates = loaded_layer.tree.query(point, predicate="dwithin", distance=NEAREST_MAX_DISTANCE)
+    distances = shapely.distance(loaded_layer.geometries[candidates], point)
+    ranked = np.lexsort((loaded_layer.fids[candidates], distances))[:NEAREST_K]
+    candidates, distances = candidates[ranked], distances[ranked]
+
+    record = {name: None for name in attribute_keys}
+    for name, possible_keys in attribute_keys.items():
+        values, has_value = loaded_layer.value_column(possible_keys)
+        hits = np.flatnonzero(has_value[candidates])
+        if len(hits):
+            record[name] = values[candidates[hits[0]]]
+            record[name + "_match"] = describe_match(distances[hits[0]])
+            log.debug(f"\033[92mFound {name} --> {record[name]} ({distances[hits[0]]:.2f} away) in loaded layer: {loaded_layer}\033[0m")
+    return record
+
+#endregion Shapely Geometry Backend
+
 #endregion QGIS Loaded Layer Helper
 
 #endregion HELPER FUNCTIONS ---------
 
-def readcsv_and_find_attributes(csv_path, layer_name_path):
-    results = []
-    # Read addresses from CSV
+# Read the addresses of the input CSV one row at a time
+def read_addresses(csv_path, start_row=0):
+    """Yields (row number, address) for every data row from start_row on."""
     with open(csv_path, newline='', encoding='utf-8') as csvfile:
-        addresses = []
         reader = csv.DictReader(csvfile)
-        for row in reader:
-            address = row.get("address") or row.get("Address")
-            addresses.append(address)
-        
-        with tqdm(total=len(addresses), unit="addr", ncols=100, desc="Processing All Addresses") as pbar:
-            for address in addresses:
-                pbar.set_description(f"\n\033[93mProcessing Address: {addresses.index(address)+1}/{len(addresses)}\033[0m")
-                addr_start = time.time()
+        for row_number, row in enumerate(reader):
+            if row_number < start_row:
+                continue
+            yield row_number, row.get("address") or row.get("Address")
+
+def readcsv_and_find_attributes(csv_path, layer_name_path, start_row=0, chunk_size=None, incremental_state=None):
+    """
+    Stream the input CSV through the pipeline, PIPELINE_CHUNK_SIZE rows at a time.
+    Yields (row number, result) for every row in input order; result is None for skipped rows.
+    With incremental_state (open_incremental_state()) unchanged rows are taken from the previous run.
+    """
+    with tqdm(initial=start_row, unit="addr", ncols=100, desc="Processing All Addresses") as pbar:
+        for chunk in read_address_chunks(csv_path, start_row, chunk_size or PIPELINE_CHUNK_SIZE):
+            results, unresolved = reuse_incremental_rows(incremental_state, chunk) if incremental_state else ({}, chunk)
+            pbar.update(len(results))
+            if unresolved:
+                results.update(find_attributes_for_chunk(unresolved, layer_name_path, pbar))
+            if incremental_state:
+                store_incremental_rows(incremental_state, unresolved, results)
+            for row_number, _ in chunk:
+                yield row_number, results.get(row_number)
+
+# Group the rows of read_addresses() into lists of chunk_size
+def read_address_chunks(csv_path, start_row, chunk_size):
+    chunk = []
+    for row_number, address in read_addresses(csv_path, start_row):
+        chunk.append((row_number, address))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# region Parallel Execution
+
+# Set up a worker process of the pool: the layers (and QGIS, for that backend) are loaded once here
+def init_pipeline_worker(layer_name_path, rate_slots, in_flight, use_mirror, bulk_join, geometry_backend, log_level):
+    global _geocode_rate_slots, _geocode_in_flight, ARC_USE_MIRROR, BULK_JOIN_MODE, GEOMETRY_BACKEND, _geocode_executor, _arc_executor
+    global _geocode_sessions, _geocode_cache_conn, _arc_session, _arc_host_semaphores
+    global _geocode_client_lock, _geocode_cache_lock, _arc_client_lock, _metrics_lock
+    _geocode_rate_slots = rate_slots
+    _geocode_in_flight = in_flight
+    # A forked worker inherits the parent's thread pools without their threads: build its own
+    _geocode_executor = None
+    _arc_executor = None
+    # Nor may it share the parent's sockets and SQLite handle, or locks / host slots held by the parent's threads.
+    # They are dropped, not closed, as they still belong to the parent
+    _geocode_sessions = {}
+    _geocode_cache_conn = None
+    _arc_session = None
+    _arc_host_semaphores = {}
+    _geocode_client_lock = threading.Lock()
+    _geocode_cache_lock = threading.Lock()
+    _arc_client_lock = threading.Lock()
+    _metrics_lock = threading.Lock()
+    # Fetched again by the worker, so a refresh in the parent is not hidden behind a stale copy
+    ARC_SERVICE_INFO.clear()
+    ARC_USE_MIRROR = use_mirror
+    BULK_JOIN_MODE = bulk_join
+    GEOMETRY_BACKEND = geometry_backend
+    configure_logging(log_level)
+    # A forked worker starts with a copy of the parent's metrics, which the parent already counts
+    drain_metrics()
+    # Its load_layer metrics go to the parent with the worker's first chunk
+    load_pipeline_layers(layer_name_path)
+
+def find_attributes_in_worker(chunk, layer_name_path):
+    """
+    Returns the chunk's [(row number, result)], the change of each PIPELINE_COUNTERS dict it caused
+    and the metrics recorded since the previous chunk.
+    """
+    counters_before = [dict(counters) for counters in PIPELINE_COUNTERS]
+    with tqdm(disable=True) as pbar:
+        results = find_attributes_for_chunk(chunk, layer_name_path, pbar)
+    counter_deltas = [{name: counters[name] - before[name] for name in counters}
+                      for counters, before in zip(PIPELINE_COUNTERS, counters_before)]
+    return [(row_number, results.get(row_number)) for row_number, _ in chunk], counter_deltas, drain_metrics()
+
+def readcsv_and_find_attributes_parallel(csv_path, layer_name_path, workers, start_row=0, chunk_size=None, incremental_state=None):
+    """
+    Same results as readcsv_and_find_attributes(), with the chunks sharded across a pool of worker processes.
+    Every worker loads its own layers; geocoding stays within GEOCODE_MIN_INTERVAL and GEOCODE_MAX_IN_FLIGHT across the pool.
+    The incremental state stays in this process: only the rows it cannot reuse are sent to the workers.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_pipeline_worker,
+                             initargs=(layer_name_path, _geocode_rate_slots, _geocode_in_flight, ARC_USE_MIRROR, BULK_JOIN_MODE,
+                                       get_geometry_backend(), log.getEffectiveLevel())) as executor, \
+         tqdm(initial=start_row, unit="addr", ncols=100, desc=f"Processing All Addresses ({workers} workers)") as pbar:
+        # Keep a bounded number of chunks in flight and merge them back in input order
+        in_flight = deque()
+        for chunk in read_address_chunks(csv_path, start_row, chunk_size or PIPELINE_CHUNK_SIZE):
+            reused, unresolved = reuse_incremental_rows(incremental_state, chunk) if incremental_state else ({}, chunk)
+            pbar.update(len(reused))
+            in_flight.append((chunk, reused, unresolved, executor.submit(find_attributes_in_worker, unresolved, layer_name_path)))
+            if len(in_flight) < 2 * workers:
+                continue
+            yield from collect_worker_results(in_flight.popleft(), pbar, incremental_state)
+        while in_flight:
+            yield from collect_worker_results(in_flight.popleft(), pbar, incremental_state)
+
+def collect_worker_results(in_flight_chunk, pbar, incremental_state=None):
+    chunk, results, unresolved, future = in_flight_chunk
+    chunk_results, counter_deltas, metrics = future.result()
+    for counters, deltas in zip(PIPELINE_COUNTERS, counter_deltas):
+        for name, count in deltas.items():
+            counters[name] += count
+    merge_metrics(metrics)
+    pbar.update(len(chunk_results))
+    results.update(chunk_results)
+    if incremental_state:
+        store_incremental_rows(incremental_state, unresolved, results)
+    return [(row_number, results.get(row_number)) for row_number, _ in chunk]
+
+#endregion Parallel Execution
+
+# Geocode and resolve the attributes of one chunk of (row number, address)
+def find_attributes_for_chunk(chunk, layer_name_path, pbar):
+    """Returns {row number: result}; skipped rows have no result."""
+    chunk_start = time.perf_counter()
+    results = {}
+    # Addresses waiting for the batched Step 2.2: (row number, address, record, lat, lon)
+    arc_pending = []
+    # Points in the parcel of a pending row but with no building yet, which only need ARC_BUILDING_SERVICES:
+    # (row number, address, record, lat, lon, parcel owner row number)
+    arc_building_pending = []
+    # Rows resolved through another row: representative row number -> [(row number, address, lat, lon)]
+    duplicate_rows = {}
+    unique_chunk = dedup_addresses(chunk, duplicate_rows)
+    # Representative row of each geocoded point / parcel seen so far
+    point_owners = {}
+    parcel_owners = {}
+    # Step 1 for every row first, so the points can be reprojected together: (row number, address, lat, lon)
+    geocoded = []
+    # The chunk's addresses are geocoded concurrently, within each provider's limits
+    addresses = [address for _, address in unique_chunk if address]
+    try:
+        locations = dict(zip(addresses, geocode_addresses(addresses)))
+    except Exception as e:
+        log.error(f"\033[91mBatch geocoding failed: {e}\033[0m")
+        locations = {}
+    for row_number, address in unique_chunk:
+        if not address:
+            log.debug(f"Skipped empty address on row {row_number+1}")
+            pbar.set_description(f"Processed {row_number+1}")
+            pbar.update(1)
+            continue
+        try:
+            # region Step 1: Geocode the address to get lat/lon
+            log.debug(f"\n\033[93mGeocoding address:\033[0m - {address}")
+            lat, lon = locations.get(address, (None, None))
+
+            if lat is None or lon is None:
+                log.warning(f"\033[91mGeocoding failed for address: {address}\033[0m")
+                results[row_number] = {"address": address, "lat": lat, "lon": lon, "parcel_id": None, "stories": None, "build_id": None, "bin":None, "match_type": None, "match_distance": None, "error": "geocoding failed"}
+                pbar.set_description(f"Processed {row_number+1}")
+                pbar.update(1)
+                continue
+            # endregion Step 1: Geocode the address to get lat/lon
+
+            log.debug(f"\033[92mGeocoded --> lat={lat}, lon={lon} \033[0m")
+
+            # Another address of the chunk geocoded to the same point: reuse its result
+            point_key = (round(lat / DEDUP_POINT_TOLERANCE), round(lon / DEDUP_POINT_TOLERANCE))
+            if point_key in point_owners:
+                add_duplicate_row(duplicate_rows, point_owners[point_key], row_number, address, lat, lon)
+                DEDUP_STATS["points"] += 1
+                continue
+            point_owners[point_key] = row_number
+            geocoded.append((row_number, address, lat, lon))
+        except Exception as e:
+            log.error(f"\033[91mError with {address}: {e}\033[0m")
+            continue
+
+    try:
+        loaded_layers = []
+        for layer_name in layer_name_path.keys():
+            loaded_layers.append(get_loaded_layers(layer_name))
+    except Exception as e:
+        log.error(f"Error accessing layers '{layer_name}': {e}")
+
+    # Reproject every geocoded point of the chunk at once, per layer CRS
+    arc_mirror_layers = [get_loaded_layers(layer_name) for layer_name in arc_mirror_layer_name_path] if ARC_USE_MIRROR else []
+    try:
+        projected_points = reproject_points_to_layers([(lat, lon) for _, _, lat, lon in geocoded],
+                                                      [layer[0] for layer in loaded_layers + arc_mirror_layers if layer])
+    except Exception as e:
+        # Points are then reprojected one by one in to_project_geom()
+        log.warning(f"Batch reprojection failed: {e}")
+        projected_points = {}
+
+    # Step 2.1 for every point of the chunk at once
+    bulk_records = None
+    if BULK_JOIN_MODE and geocoded:
+        try:
+            bulk_records = bulk_join_points([layer[0] for layer in loaded_layers if layer], projected_points, len(geocoded))
+        except Exception as e:
+            # Each point then goes through resolve_attributes_via_loaded_layer()
+            log.warning(f"Bulk spatial join failed: {e}")
+
+    for point_index, (row_number, address, lat, lon) in enumerate(geocoded):
+        try:
+            parcel_id = None
+            stories = None
+            build_id = None
+
+            # region Step 2: Query for Attributes
+
+            # region Step 2.1: Using Loaded Layers in QGIS\n")
+            log.debug("\n\033[93mStep 2.1: Checking loaded layers in QGIS for missing information\033[0m")
             
-                if not address:
-                    addr_elapsed = time.time() - addr_start
-                    pbar.set_description(f"Processed {addresses.index(address)+1}/{len(addresses)} (Last: {addr_elapsed:.2f}s) - \033[91mSkipped empty address\033[0m ")
-                    pbar.update(1)
-                    continue
-                try:
-                    # region Step 1: Geocode the address to get lat/lon
-                    parcel_id = None
-                    stories = None
-                    build_id = None
-                    bin_val = None
-
-                    print(f"\n\033[93mGeocoding address:\033[0m - {address}")
-                    lat, lon = geocode_address(address)
-
-                    if lat is None or lon is None:
-                        # try Google Geocoding as fallback
-                        print("\nNominatim geocoding failed, trying Google Geocoding...")
-                        lat, lon = geocode_google(address)
-
-                    if lat is None or lon is None:
-                        print(f"\033[91mGeocoding failed for address: {address}\033[0m")
-                        results.append({"address": address, "lat": lat, "lon": lon, "parcel_id": parcel_id, "stories": stories, "build_id": build_id, "bin":None, "error": "geocoding failed"})
-                        addr_elapsed = time.time() - addr_start
-                        pbar.set_description(f"Processed {addresses.index(address)+1}/{len(addresses)} (Last: {addr_elapsed:.2f}s) - Geocoding failed")
-                        pbar.update(1)
-                        continue
-                    # endregion Step 1: Geocode the address to get lat/lon
-
-                    print(f"\033[92mGeocoded --> lat={lat}, lon={lon} \033[0m")
-                    # region Step 2: Query for Attributes
-
-                    # region Step 2.1: Using Loaded Layers in QGIS\n")
-                    print ("\n\033[93mStep 2.1: Checking loaded layers in QGIS for missing information\033[0m")
-                    
-                    try:
-                        loaded_layers = []
-                        for layer_name in layer_name_path.keys():
-                            loaded_layers.append(qgis_project.mapLayersByName(layer_name))
-                    except Exception as e:
-                        print(f"Error accessing layers '{layer_name}': {e}")
-                    
-                    try:
-                        if loaded_layers == []:
-                            raise Exception("No layers loaded in the project.")
-                        
-                        print("\033[92mLoaded layers:\033[0m", loaded_layers)
-                    
-                        if parcel_id == None or parcel_id == '' or parcel_id == ' ' or parcel_id == "NULL" or parcel_id == "NaN":
-                            print("\nTrying to find Parcel_ID using loaded layer.")
-                            
-                            for loaded_layer in loaded_layers:
-                                parcel_id = find_attribute_value_via_laoded_layer(loaded_layer[0], lat, lon, 'Parcel_ID', parcel_id, POSSIBLE_PARCEL_ID_KEYS) 
-                                if (parcel_id != None) and (parcel_id != '' or parcel_id != ' ' or parcel_id != "NULL" or parcel_id != "NaN"):                                   
-                                    break
-                                else:
-                                    print(f"\033[91mNo Parcel_ID found in the loaded layer:\033[0m {loaded_layer}")
-                                
-                        if stories == None or stories == '' or stories == ' ' or stories == "NULL" or stories == "NaN":
-                            print("\nTrying to find Stories using loaded layer.")
-                            for loaded_layer in loaded_layers:
-                                stories = find_attribute_value_via_laoded_layer(loaded_layer[0], lat, lon, 'Stories', stories, POSSIBLE_STORY_KEYS)          
-                                if (stories != None) and (stories != '' or stories != ' ' or stories != "NULL" or stories != "NaN"):
-                                    break
-                                else:
-                                    print(f"\033[91mNo Stories found in the loaded layer:\033[0m {loaded_layer}")
-                    
-                        if build_id == None or build_id == '' or build_id == ' ' or build_id == "NULL" or build_id == "NaN":
-                            print("\nTrying to find Build_ID using loaded layer.")
-                            for loaded_layer in loaded_layers:
-                                build_id = find_attribute_value_via_laoded_layer(loaded_layer[0], lat, lon, 'Build_Id', build_id, POSSIBLE_BUILD_ID_KEYS)
-                                if (build_id != None) and (build_id != '' or build_id != ' ' or build_id != "NULL" or build_id != "NaN"):
-                                    break
-                                else:
-                                    print(f"\033[91mNo Build_ID found in the loaded layer:\033[0m {loaded_layer}")                     
-                        if (
-                            (parcel_id != None) and (parcel_id != '' or parcel_id != ' ' or parcel_id != "NULL" or parcel_id != "NaN") and
-                            (stories != None) and (stories != '' or stories != ' ' or stories != "NULL" or stories != "NaN") and
-                            (build_id != None) and (build_id != '' or build_id != ' ' or build_id != "NULL" or build_id != "NaN")
-                            ):
-                            print("Found all values on the Loaded Layers in QGIS")
-                            process_output(results, addresses, address, pbar, addr_start, parcel_id, stories, build_id, lat, lon)
-                            continue   
-                                
-                    except Exception as e:
-                        print(e)
-                    
-                    print(f"\n\033[93mProcessed Output from Loaded Layers:\033[0m \n{address} → Parcel ID: {parcel_id}, Stories: {stories}, Build_ID: {build_id}")
-                    # endregion Step 2.1: Using Loaded Layers in QGIS
-                    
-                    # region Step 2.2: Using Arc Services to find missing information \n")
-                    try:                       
-                        counter = 1
-                        print ("\n\033[93mStep 2.2: Querying ArcGIS services for information\033[0m")
-                        for svc in ARC_SERVICES:
-                            if counter > len(ARC_SERVICES):
-                                break 
-                            
-                            print("\nQuerying service #", counter , ": ", svc)
-
-                            svc_response = query_arcgis_service(svc, lat, lon, try_geojson=True)
-
-                            if not svc_response:
-                                # try with geo_json=False fallback
-                                svc_response = query_arcgis_service(svc, lat, lon, try_geojson=False)
-                                
-                            if not svc_response:
-                                print("No response found on #", counter ," service.")
-                                counter += 1
-                                continue
-                            else:
-                                print("\033[92mService response found on #", counter ," service.\033[0m")
-
-                            attributes = svc_response.get("attributes", {})
-
-                            if parcel_id == None or parcel_id == '' or parcel_id == ' ' or parcel_id == "NULL" or parcel_id == "NaN":
-                                parcel_id = extract_value_from_attributes(attributes,POSSIBLE_PARCEL_ID_KEYS)
-                                if (parcel_id != None) and (parcel_id != '' or parcel_id != ' ' or parcel_id != "NULL" or parcel_id != "NaN"):
-                                    print(f"\033[92mFound parcel_id on service #{counter}:, Parcel_Id: {parcel_id}\033[0m")
-                            
-                            if stories == None or stories == '' or stories == ' ' or stories == "NULL" or stories == "NaN":
-                                stories = extract_value_from_attributes(attributes,POSSIBLE_STORY_KEYS)
-                                if (stories != None) and (stories != '' or stories != ' ' or stories != "NULL" or stories != "NaN"):    
-                                    print(f"\033[92mFound stories on service #{counter}:, Stories: {stories}\033[0m")
-
-                            if build_id == None or build_id == '' or build_id == ' ' or build_id == "NULL" or build_id == "NaN":
-                                build_id = extract_value_from_attributes(attributes,POSSIBLE_BUILD_ID_KEYS)
-                                if (build_id != None) and (build_id != '' or build_id != ' ' or build_id != "NULL" or build_id != "NaN"):    
-                                    print(f"\033[92mFound build_id on service #{counter}:, Build_ID: {build_id}\033[0m")                          
-                            if (
-                                (parcel_id != None) and (parcel_id != '' or parcel_id != ' ' or parcel_id != "NULL" or parcel_id != "NaN") and
-                                (stories != None) and (stories != '' or stories != ' ' or stories != "NULL" or stories != "NaN") and
-                                (build_id != None) and (build_id != '' or build_id != ' ' or build_id != "NULL" or build_id != "NaN")
-                            ):
-                                print("Found all values on ARC Services")  
-
-                            counter += 1
-
-                        print(f"\n\033[93mProcessed Output after using Arc Services:\033[0m \n{address} → Parcel ID: {parcel_id}, Stories: {stories}, Build_ID: {build_id}")
+            record = {"parcel_id": parcel_id, "stories": stories, "build_id": build_id}
+            try:
+                if loaded_layers == []:
+                    raise Exception("No layers loaded in the project.")
+                
+                log.debug(f"\033[92mLoaded layers:\033[0m {loaded_layers}")
+
+                if bulk_records is not None:
+                    # Already resolved for the whole chunk by the bulk spatial join
+                    record.update({name: value for name, value in bulk_records[point_index].items() if not is_missing_value(value)})
+
+                # One intersection pass per layer resolves every attribute that is still missing
+                for loaded_layer in (loaded_layers if bulk_records is None else []):
+                    missing_keys = missing_attribute_keys(record)
+                    if not missing_keys:
+                        break
+                    log.debug(f"\nTrying to find {', '.join(missing_keys)} using loaded layer.")
+                    point_xy = projected_point(projected_points, loaded_layer[0], point_index)
+                    with timed_stage(f"layer:{loaded_layer[0].name()}"):
+                        layer_record = resolve_attributes_via_loaded_layer(loaded_layer[0], lat, lon, missing_keys, point_xy)
+                    record.update({name: value for name, value in layer_record.items() if not is_missing_value(value)})
+                    for name in missing_attribute_keys(record):
+                        log.debug(f"\033[91mNo {name} found in the loaded layer:\033[0m {loaded_layer}")
+
+                parcel_id, stories, build_id = record["parcel_id"], record["stories"], record["build_id"]
+                if not missing_attribute_keys(record):
+                    log.debug("Found all values on the Loaded Layers in QGIS")
+                    process_output(results, row_number, address, pbar, parcel_id, stories, build_id, lat, lon,
+                                   record.get("parcel_id_match"))
+                    continue   
                         
-                    except Exception as e:
-                        print(e)
-                    
-                    # endregion Step 2.2: Using Arc Services to find missing information
-                    #endregion Step 2: Query for Attributes
-
-                    #region Final Output        
-                    process_output(results, addresses, address, pbar, addr_start, parcel_id, stories, build_id, lat, lon)
-                    #endregion Final Output
-                except Exception as e:
-                    print(f"\033[91mError with {address}: {e}\033[0m")
+            except Exception as e:
+                log.warning(e)
+            
+            log.debug(f"\n\033[93mProcessed Output from Loaded Layers:\033[0m \n{address} → Parcel ID: {parcel_id}, Stories: {stories}, Build_ID: {build_id}")
+            # endregion Step 2.1: Using Loaded Layers in QGIS
+            
+            # Another point of the chunk fell in the same parcel / building: reuse its Step 2.2 result
+            if DEDUP_BY_PARCEL and not is_missing_value(record["parcel_id"]):
+                parcel_key = tuple(None if is_missing_value(record[name]) else str(record[name]) for name in ATTRIBUTE_KEYS)
+                owner = parcel_owners.get(parcel_key)
+                if owner is not None and not is_missing_value(record["build_id"]):
+                    add_duplicate_row(duplicate_rows, owner, row_number, address, lat, lon, record.get("parcel_id_match"))
+                    DEDUP_STATS["parcels"] += 1
                     continue
+                if owner is not None and not ARC_USE_MIRROR:
+                    # A parcel can hold several buildings: the building services still have to see this point
+                    arc_building_pending.append((row_number, address, record, lat, lon, owner))
+                    DEDUP_STATS["parcel_services"] += 1
+                    continue
+                if owner is None:
+                    parcel_owners[parcel_key] = row_number
+
+            # region Step 2.2: Using Arc Services to find missing information \n")
+            if ARC_USE_MIRROR:
+                # Same loaded-layer path as Step 2.1, against the local mirror of ARC_SERVICES
+                log.debug("\n\033[93mStep 2.2: Checking the ArcGIS services mirror for information\033[0m")
+                for layer_name in arc_mirror_layer_name_path.keys():
+                    missing_keys = missing_attribute_keys(record)
+                    if not missing_keys:
+                        log.debug("Found all values on the ArcGIS services mirror")
+                        break
+                    mirror_layers = get_loaded_layers(layer_name)
+                    if not mirror_layers:
+                        log.warning(f"\033[91mMirror layer {layer_name} is not loaded\033[0m")
+                        continue
+                    point_xy = projected_point(projected_points, mirror_layers[0], point_index)
+                    with timed_stage(f"layer:{layer_name}"):
+                        layer_record = resolve_attributes_via_loaded_layer(mirror_layers[0], lat, lon, missing_keys, point_xy)
+                    record.update({name: value for name, value in layer_record.items() if not is_missing_value(value)})
+
+                parcel_id, stories, build_id = record["parcel_id"], record["stories"], record["build_id"]
+                process_output(results, row_number, address, pbar, parcel_id, stories, build_id, lat, lon,
+                               record.get("parcel_id_match"))
+                continue
+
+            # Defer to one query fan-out for the whole chunk once every address has been geocoded
+            log.debug("\n\033[93mStep 2.2: Queued for ArcGIS service queries\033[0m")
+            arc_pending.append((row_number, address, record, lat, lon))
+            # endregion Step 2.2: Using Arc Services to find missing information
+            #endregion Step 2: Query for Attributes
+        except Exception as e:
+            log.error(f"\033[91mError with {address}: {e}\033[0m")
+            continue
+
+    # region Step 2.2 for the chunk: one query per tile of addresses per service (ARC_BATCH_MODE), else per address, all concurrently
+    if arc_pending:
+        log.debug(f"\n\033[93mStep 2.2: Querying ArcGIS services for {len(arc_pending)} addresses\033[0m")
+        batch_responses = query_arcgis_services_for_chunk([(lat, lon) for _, _, _, lat, lon in arc_pending], ARC_SERVICES)
+
+        if arc_building_pending:
+            # The parcel services' answers come from the owner row, the building services' from the point itself
+            building_services = [ARC_SERVICES[s] for s in ARC_BUILDING_SERVICES]
+            building_responses = query_arcgis_services_for_chunk([(lat, lon) for _, _, _, lat, lon, _ in arc_building_pending],
+                                                                 building_services)
+            owner_responses = {pending[0]: svc_responses for pending, svc_responses in zip(arc_pending, batch_responses)}
+            for (row_number, address, record, lat, lon, owner), point_responses in zip(arc_building_pending, building_responses):
+                svc_responses = list(owner_responses[owner])
+                for s, svc_response in zip(ARC_BUILDING_SERVICES, point_responses):
+                    svc_responses[s] = svc_response
+                arc_pending.append((row_number, address, record, lat, lon))
+                batch_responses.append(svc_responses)
+
+        for (row_number, address, record, lat, lon), svc_responses in zip(arc_pending, batch_responses):
+            apply_arc_service_responses(record, svc_responses)
+            log.debug(f"\n\033[93mProcessed Output after using Arc Services:\033[0m \n{address} → Parcel ID: {record['parcel_id']}, Stories: {record['stories']}, Build_ID: {record['build_id']}")
+            process_output(results, row_number, address, pbar, record["parcel_id"], record["stories"], record["build_id"], lat, lon,
+                           record.get("parcel_id_match"), record.get("arc_failed", False))
+    # endregion Step 2.2 for the chunk
 
+    # Fan the representative results back out to their duplicate rows
+    for owner, rows in duplicate_rows.items():
+        if owner not in results:
+            continue
+        for row_number, address, lat, lon, match in rows:
+            results[row_number] = dict(results[owner], address=address)
+            if lat is not None:
+                results[row_number].update(lat=lat, lon=lon)
+            if match is not None:
+                results[row_number].update(match_type=match[0], match_distance=match[1])
+            pbar.update(1)
+
+    # Rows of a chunk are processed together (batched geocoding, reprojection and Step 2.2), so time the chunk, not the row
+    record_stage("pipeline:chunk", time.perf_counter() - chunk_start)
+    count_event("pipeline:rows", len(chunk))
     return results 
 
-def process_output(results, addresses, address, pbar, addr_start, parcel_id, stories, build_id, lat, lon):
-    print(f"\n\033[92mFinal Processed Output:\033[0m \n{address} → Parcel ID: {parcel_id}, Stories: {stories}, Build_ID: {build_id}")
+# Step 2.2 queries of a chunk's points against services, every service failed for every point if the fan-out itself fails
+def query_arcgis_services_for_chunk(points, services):
+    try:
+        return query_arcgis_services_batch(points, services) if ARC_BATCH_MODE else query_arcgis_services_bulk(points, services)
+    except Exception as e:
+        log.warning(e)
+        return [[ARC_QUERY_FAILED] * len(services) for _ in points]
+
+# region Deduplication
+
+# Collapse the rows of a chunk whose addresses normalize to the same key
+def dedup_addresses(chunk, duplicate_rows):
+    """Returns the rows to resolve; the duplicates of each are recorded in duplicate_rows under its row number."""
+    representatives = {}
+    unique_chunk = []
+    for row_number, address in chunk:
+        key = normalize_address(address) if address else None
+        if key in representatives:
+            add_duplicate_row(duplicate_rows, representatives[key], row_number, address)
+            DEDUP_STATS["addresses"] += 1
+            continue
+        if key:
+            representatives[key] = row_number
+        unique_chunk.append((row_number, address))
+    return unique_chunk
 
+def add_duplicate_row(duplicate_rows, owner, row_number, address, lat=None, lon=None, match=None):
+    # Rows that were already duplicates of row_number follow it to the new owner; a parcel duplicate keeps its own match
+    rows = duplicate_rows.setdefault(owner, [])
+    rows.append((row_number, address, lat, lon, match))
+    rows.extend(duplicate_rows.pop(row_number, []))
+
+#endregion Deduplication
+
+# Fill the record's missing attributes from the service responses, in ARC_SERVICES order
+def apply_arc_service_responses(record, svc_responses):
+    for counter, (svc, svc_response) in enumerate(zip(ARC_SERVICES, svc_responses), start=1):
+        missing_keys = missing_attribute_keys(record)
+        if not missing_keys:
+            log.debug("Found all values on ARC Services")
+            break
+        
+        log.debug(f"\nService #{counter}: {svc}")
+
+        if not svc_response:
+            log.debug(f"No response found on #{counter} service.")
+            continue
+        if svc_response.get("failed"):
+            # A value may still be missing only because this service failed
+            log.debug(f"\033[91mService #{counter} failed.\033[0m")
+            record["arc_failed"] = True
+            continue
+        else:
+            log.debug(f"\033[92mService response found on #{counter} service.\033[0m")
+
+        attributes = svc_response.get("attributes", {})
+
+        # Pull every missing attribute from the service response in one pass
+        for name, value in extract_values_from_attributes(attributes, missing_keys).items():
+            record[name] = value
+            # The services are queried with the point itself, so their features contain it
+            record[name + "_match"] = describe_match(0)
+            log.debug(f"\033[92mFound {name} on service #{counter}: {value}\033[0m")
+    return record
+
+# match is the (match type, distance) of the parcel_id, see describe_match(); arc_failed marks a row left incomplete by a failed ArcGIS service
+def process_output(results, row_number, address, pbar, parcel_id, stories, build_id, lat, lon, match=None, arc_failed=False):
+    log.debug(f"\n\033[92mFinal Processed Output:\033[0m \n{address} → Parcel ID: {parcel_id}, Stories: {stories}, Build_ID: {build_id}")
+
+    match_type, match_distance = match or (None, None)
     if parcel_id != None: 
-        bin_val = create_bin(parcel_id, build_id)
-        results.append({"address": address, "lat": lat, "lon": lon, "parcel_id": parcel_id, "stories": stories, "build_id":build_id, "bin": bin_val,"error": None})     
+        with timed_stage("bin:create_bin"):
+            bin_val = create_bin(parcel_id, build_id)
+        results[row_number] = {"address": address, "lat": lat, "lon": lon, "parcel_id": parcel_id, "stories": stories, "build_id":build_id, "bin": bin_val,
+                               "match_type": match_type, "match_distance": match_distance, "error": ARC_FAILED_ERROR if arc_failed else None}
     else:
-        results.append({"address": address, "lat": lat, "lon": lon, "parcel_id": parcel_id, "stories": stories, "build_id":build_id, "bin": None,"error": "Parcel_ID not found"})
+        results[row_number] = {"address": address, "lat": lat, "lon": lon, "parcel_id": parcel_id, "stories": stories, "build_id":build_id, "bin": None,
+                               "match_type": None, "match_distance": None, "error": ARC_FAILED_ERROR if arc_failed else "Parcel_ID not found"}
 
-    addr_elapsed = time.time() - addr_start
-    pbar.set_description(f"\n\033[92mProcessed {addresses.index(address)+1}/{len(addresses)} (Last: {addr_elapsed:.2f}s)\033[0m\n")
+    pbar.set_description(f"Processed {row_number+1}")
     pbar.update(1)       
 
-def save_results_to_csv(results, output_csv):
-    # Save results to CSV
-    with open(output_csv, "w", newline='', encoding='utf-8') as outfile:
-        fieldnames = ["address", "lat", "lon", "parcel_id", "stories", "build_id", "bin", "error"]
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(results)
+# region Checkpointed Output
+
+def load_checkpoint(checkpoint_path, csv_path):
+    """Returns the checkpoint of an interrupted run over csv_path, or None if there is nothing to resume."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    input_stat = os.stat(csv_path)
+    if (checkpoint.get("input_csv") != os.path.abspath(csv_path) or checkpoint.get("input_size") != input_stat.st_size
+            or checkpoint.get("input_mtime") != input_stat.st_mtime):
+        log.info("Input CSV changed since the last checkpoint, starting over.")
+        return None
+    return checkpoint
+
+def write_checkpoint(checkpoint_path, csv_path, outfile, rows_done):
+    # The output must be on disk before the checkpoint points past it
+    outfile.flush()
+    os.fsync(outfile.fileno())
+    input_stat = os.stat(csv_path)
+    checkpoint = {"input_csv": os.path.abspath(csv_path), "input_size": input_stat.st_size, "input_mtime": input_stat.st_mtime,
+                  "rows_done": rows_done, "output_bytes": os.fstat(outfile.fileno()).st_size}
+    with open(checkpoint_path + ".tmp", "w", encoding='utf-8') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+# Stream the pipeline results into output_csv, resuming an interrupted run from its checkpoint
+def run_pipeline(csv_path, output_csv, layer_name_path, resume=True, workers=1, incremental=False):
+    """
+    Rows are written as they complete and flushed every OUTPUT_FLUSH_ROWS rows together with a checkpoint
+    (output_csv + '.checkpoint') of the processed input rows. With workers > 1 the rows are processed by a
+    process pool; with incremental the rows unchanged since the previous run are reused (see Incremental Runs).
+    Returns the number of input rows processed.
+    """
+    checkpoint_path = output_csv + ".checkpoint"
+    checkpoint = load_checkpoint(checkpoint_path, csv_path) if resume else None
+
+    incremental_state = None
+    if incremental:
+        incremental_state = open_incremental_state(output_csv + ".state.db")
+        refresh_incremental_state(incremental_state, layer_name_path)
+
+    start_row = 0
+    if checkpoint and os.path.exists(output_csv):
+        start_row = checkpoint["rows_done"]
+        # Drop the rows written after the last checkpoint, they are processed again
+        with open(output_csv, "r+b") as outfile:
+            outfile.truncate(checkpoint["output_bytes"])
+        log.info(f"Resuming {csv_path} from row {start_row + 1}")
+
+    rows_done = start_row
+    with open(output_csv, "a" if start_row else "w", newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=OUTPUT_FIELDNAMES)
+        if not start_row:
+            writer.writeheader()
+        try:
+            if workers > 1:
+                row_results = readcsv_and_find_attributes_parallel(csv_path, layer_name_path, workers, start_row,
+                                                                   incremental_state=incremental_state)
+            else:
+                row_results = readcsv_and_find_attributes(csv_path, layer_name_path, start_row, incremental_state=incremental_state)
+            for row_number, result in row_results:
+                if result is not None:
+                    with timed_stage("csv:write_row"):
+                        writer.writerow(result)
+                rows_done = row_number + 1
+                if (rows_done - start_row) % OUTPUT_FLUSH_ROWS == 0:
+                    with timed_stage("csv:checkpoint"):
+                        write_checkpoint(checkpoint_path, csv_path, outfile, rows_done)
+        except KeyboardInterrupt:
+            write_checkpoint(checkpoint_path, csv_path, outfile, rows_done)
+            log.warning(f"\n\033[93mInterrupted after row {rows_done}, rerun to resume.\033[0m")
+            raise
+        finally:
+            if incremental_state is not None:
+                incremental_state.close()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return rows_done
+
+#endregion Checkpointed Output
+
+# region Incremental Runs
+
+# State of the previous runs: their results by normalized address, the source versions they were resolved
+# against and a digest per layer feature, to tell which parcels changed
+def open_incremental_state(state_path):
+    conn = sqlite3.connect(state_path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS row_state (
+                        address_key TEXT PRIMARY KEY,
+                        lat REAL,
+                        lon REAL,
+                        result TEXT NOT NULL,
+                        resolved_at REAL NOT NULL)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS source_state (
+                        source TEXT PRIMARY KEY,
+                        version TEXT NOT NULL)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS layer_features (
+                        source TEXT NOT NULL,
+                        fid INTEGER NOT NULL,
+                        hash TEXT NOT NULL,
+                        xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+                        PRIMARY KEY (source, fid))""")
+    conn.commit()
+    return conn
+
+# Version of every source a result depends on: the lookup settings, each layer file and each ArcGIS service
+def current_source_versions(layer_name_path):
+    """Returns {source: version}; the version is None when it cannot be read right now (service down)."""
+    settings = [ATTRIBUTE_KEYS, ARC_SERVICES, ARC_USE_MIRROR, NEAREST_MAX_DISTANCE, NEAREST_K, sorted(layer_name_path)]
+    versions = {"settings": hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()}
+    layer_paths = dict(layer_name_path, **(arc_mirror_layer_name_path if ARC_USE_MIRROR else {}))
+    for layer_name, layer_path in layer_paths.items():
+        versions[f"layer:{layer_name}"] = layer_file_version(project_path + layer_path)
+    if not ARC_USE_MIRROR:
+        for service_url in ARC_SERVICES:
+            info = get_arc_service_info(service_url, refresh=True)
+            versions[f"service:{service_url}"] = str(info["last_edit_date"]) if info["fields"] else None
+    return versions
+
+def layer_file_version(layer_path):
+    """Size and modification time of the layer's file and, for a shapefile, of its sidecar files."""
+    path = layer_path.partition("|layername=")[0]
+    stem, extension = os.path.splitext(path)
+    files = [stem + ext for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg")] if extension.lower() == ".shp" else [path]
+    return ";".join(f"{os.path.basename(name)}:{os.path.getsize(name)}:{os.stat(name).st_mtime_ns}"
+                    for name in files if os.path.exists(name))
+
+# Compare the sources with the previous run and forget the stored rows a change may affect
+def refresh_incremental_state(state, layer_name_path):
+    """Returns the number of stored rows that will be resolved again because of changed sources."""
+    stored_versions = dict(state.execute("SELECT source, version FROM source_state"))
+    forgotten = 0
+    for source, version in current_source_versions(layer_name_path).items():
+        if version is None:
+            log.warning(f"Could not read the version of {source}, its stored rows are reused as they are")
+            continue
+        if stored_versions.get(source) == version:
+            continue
+        kind, _, name = source.partition(":")
+        if kind == "settings":
+            forgotten += state.execute("DELETE FROM row_state").rowcount
+        elif kind == "layer":
+            loaded_layers = get_loaded_layers(name)
+            if not loaded_layers:
+                load_layers(project_path, name, dict(layer_name_path, **arc_mirror_layer_name_path)[name])
+                loaded_layers = get_loaded_layers(name)
+            if not loaded_layers:
+                forgotten += state.execute("DELETE FROM row_state").rowcount
+            else:
+                boxes = changed_feature_boxes(state, source, loaded_layers[0])
+                # A layer seen for the first time has no rows resolved against it yet
+                if source in stored_versions:
+                    forgotten += forget_rows_near(state, boxes, loaded_layers[0].crs(), NEAREST_MAX_DISTANCE)
+        elif source in stored_versions:
+            boxes = changed_service_boxes(name, stored_versions[source])
+            if boxes is None:
+                forgotten += state.execute("DELETE FROM row_state").rowcount
+            else:
+                forgotten += forget_rows_near(state, boxes)
+        log.info(f"{source} changed since the last run")
+        state.execute("INSERT OR REPLACE INTO source_state VALUES (?, ?)", (source, version))
+    state.commit()
+    count_event("incremental:forgotten", forgotten)
+    log.info(f"Incremental run: {forgotten} stored rows affected by changed sources")
+    return forgotten
+
+def layer_feature_digests(loaded_layer):
+    """Yields (fid, digest of geometry and attributes, xmin, ymin, xmax, ymax) for every feature of the layer."""
+    if isinstance(loaded_layer, ShapelyLayer):
+        wkbs = shapely.to_wkb(loaded_layer.geometries)
+        columns = [column.tolist() for column in loaded_layer.field_data]
+        rows = list(zip(*columns)) if columns else [()] * len(wkbs)
+        for fid, wkb, values, bounds in zip(loaded_layer.fids.tolist(), wkbs, rows, shapely.bounds(loaded_layer.geometries).tolist()):
+            yield (fid, hashlib.sha1(wkb + repr(values).encode()).hexdigest(), *bounds)
+        return
+    for feature in loaded_layer.getFeatures():
+        geometry = feature.geometry()
+        box = geometry.boundingBox()
+        digest = hashlib.sha1(bytes(geometry.asWkb()) + repr(feature.attributes()).encode()).hexdigest()
+        yield feature.id(), digest, box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()
+
+# Diff the layer against its stored feature digests, then store the current ones
+def changed_feature_boxes(state, source, loaded_layer):
+    """Returns the bounding boxes (layer CRS) of the added and removed features and both extents of the edited ones."""
+    stored = {row[0]: (row[1], row[2:]) for row in
+              state.execute("SELECT fid, hash, xmin, ymin, xmax, ymax FROM layer_features WHERE source = ?", (source,))}
+    current = list(layer_feature_digests(loaded_layer))
+    boxes = []
+    for fid, digest, *bounds in current:
+        previous = stored.pop(fid, None)
+        if previous is None or previous[0] != digest:
+            boxes.append(bounds)
+            if previous is not None:
+                boxes.append(previous[1])
+    # Features that are gone
+    boxes.extend(bounds for _, bounds in stored.values())
+
+    state.execute("DELETE FROM layer_features WHERE source = ?", (source,))
+    state.executemany("INSERT INTO layer_features VALUES (?, ?, ?, ?, ?, ?, ?)", ((source, *row) for row in current))
+    return boxes
+
+# Extents of the service features edited after the previous run's last edit date
+def changed_service_boxes(service_url, previous_version):
+    """Returns the bounding boxes (WGS84) of the edited features, or None when the edits cannot be listed."""
+    info = get_arc_service_info(service_url)
+    if not info["edit_date_field"] or not previous_version.isdigit():
+        return None
+    since = datetime.fromtimestamp(int(previous_version) / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    params = {"where": f"{info['edit_date_field']} > timestamp '{since}'", "outFields": info["object_id_field"] or "*",
+              "returnGeometry": "true", "outSR": "4326"}
+    boxes = []
+    for data in arcgis_query_pages(service_url, params):
+        if data is None:
+            return None
+        for feat in data["features"]:
+            coordinates = [point for ring in geometry_rings(feat.get("geometry")) for point in ring]
+            if coordinates:
+                xs, ys = [point[0] for point in coordinates], [point[1] for point in coordinates]
+                boxes.append((min(xs), min(ys), max(xs), max(ys)))
+    return boxes
+
+# Forget the stored rows whose point lies within distance of one of the boxes
+def forget_rows_near(state, boxes, crs=None, distance=0):
+    """boxes are in crs (a layer CRS), or in WGS84 when crs is None. Returns the number of rows forgotten."""
+    if not boxes:
+        return 0
+    rows = state.execute("SELECT address_key, lat, lon FROM row_state").fetchall()
+    if not rows:
+        return 0
+    if shapely is None or np is None:
+        # No spatial test available: every stored row is resolved again
+        return state.execute("DELETE FROM row_state").rowcount
+    if crs is None:
+        xs, ys = np.array([lon for _, _, lon in rows]), np.array([lat for _, lat, _ in rows])
+    else:
+        xs, ys = reproject_points([(lat, lon) for _, lat, lon in rows], crs)
+    tree = shapely.STRtree(shapely.box(*np.asarray(boxes, dtype=float).T))
+    point_indexes, _ = tree.query(shapely.points(np.asarray(xs), np.asarray(ys)), predicate="dwithin", distance=distance)
+    address_keys = {rows[i][0] for i in point_indexes.tolist()}
+    state.executemany("DELETE FROM row_state WHERE address_key = ?", ((address_key,) for address_key in address_keys))
+    return len(address_keys)
+
+# Geocode the pipeline would use for the address now, from the geocode cache (no request)
+def cached_geocode(address):
+    with _geocode_cache_lock:
+        for provider in geocode_providers():
+            row = get_geocode_cache().execute(
+                "SELECT lat, lon FROM geocode_cache WHERE address_key = ? AND provider = ? AND expires_at > ? AND lat IS NOT NULL",
+                (normalize_address(address), provider, time.time())).fetchone()
+            if row is not None:
+                return row
+    return None
+
+# Split a chunk into the rows whose stored result is still valid and the rows to resolve
+def reuse_incremental_rows(state, chunk):
+    """Returns ({row number: stored result}, [(row number, address)] to resolve)."""
+    reused = {}
+    unresolved = []
+    oldest = time.time() - INCREMENTAL_MAX_AGE
+    for row_number, address in chunk:
+        row = None
+        if address:
+            row = state.execute("SELECT lat, lon, result FROM row_state WHERE address_key = ? AND resolved_at > ?",
+                                (normalize_address(address), oldest)).fetchone()
+        if row is not None:
+            # A newer geocode of the address (e.g. after its cache entry expired) moves it to other parcels
+            geocode = cached_geocode(address)
+            if geocode is not None and (abs(geocode[0] - row[0]) > DEDUP_POINT_TOLERANCE or abs(geocode[1] - row[1]) > DEDUP_POINT_TOLERANCE):
+                row = None
+        if row is None:
+            unresolved.append((row_number, address))
+            continue
+        # The stored BIN is reused as is: create_bin() only depends on parcel_id and build_id
+        reused[row_number] = dict(json.loads(row[2]), address=address)
+    count_event("incremental:reused", len(reused))
+    count_event("incremental:resolved", len(unresolved))
+    return reused, unresolved
+
+def store_incremental_rows(state, chunk, results):
+    now = time.time()
+    rows = []
+    for row_number, address in chunk:
+        result = results.get(row_number)
+        # Geocoding and ArcGIS failures are retried on the next run
+        if not address or result is None or result["lat"] is None or result["error"] == ARC_FAILED_ERROR:
+            continue
+        rows.append((normalize_address(address), result["lat"], result["lon"], json.dumps(result, default=str), now))
+    state.executemany("INSERT OR REPLACE INTO row_state VALUES (?, ?, ?, ?, ?)", rows)
+    state.commit()
+
+#endregion Incremental Runs
+
+# region Lookup Service
+
+SERVICE_STATS = {"requests": 0, "addresses": 0, "errors": 0, "lookup_seconds": 0.0}
+# QGIS layers are not safe to read from several threads, so lookups run one at a time
+_service_lock = threading.Lock()
+_service_started_at = None
+
+# Resolve addresses through the same chunk pipeline as a CSV run
+def lookup_addresses(addresses):
+    """Returns one process_output() record per address (None for an empty address)."""
+    chunk = list(enumerate(addresses))
+    lookup_start = time.time()
+    with _service_lock:
+        with tqdm(disable=True) as pbar:
+            results = find_attributes_for_chunk(chunk, layer_name_path, pbar)
+        SERVICE_STATS["addresses"] += len(addresses)
+        SERVICE_STATS["lookup_seconds"] += time.time() - lookup_start
+    return [results.get(row_number) for row_number, _ in chunk]
+
+def service_stats():
+    lookups = SERVICE_STATS["addresses"]
+    return {
+        "uptime_seconds": round(time.time() - _service_started_at, 1),
+        "service": dict(SERVICE_STATS, avg_lookup_ms=round(1000 * SERVICE_STATS["lookup_seconds"] / lookups, 2) if lookups else None),
+        "geocode_cache": dict(GEOCODE_CACHE_STATS),
+        "dedup": dict(DEDUP_STATS),
+        "arc_service_formats": dict(ARC_SERVICE_FORMATS),
+        "metrics": metrics_report(),
+    }
+
+class LookupRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health                      -> loaded layers
+    GET  /stats                       -> service, geocode cache and dedup counters, stage metrics
+    GET  /metrics                     -> stage metrics in the Prometheus text format
+    GET  /lookup?address=...          -> one record
+    POST /lookup/batch {"addresses"}  -> {"results": [record, ...]}
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            layer_names = list(layer_name_path) + (list(arc_mirror_layer_name_path) if ARC_USE_MIRROR else [])
+            layers = {layer.name(): layer.featureCount() for layer_name in layer_names for layer in get_loaded_layers(layer_name)}
+            self.send_json(200, {"status": "ok" if layers else "no layers loaded", "layers": layers})
+        elif url.path == "/stats":
+            self.send_json(200, service_stats())
+        elif url.path == "/metrics":
+            body = metrics_as_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif url.path == "/lookup":
+            address = parse_qs(url.query).get("address", [""])[0].strip()
+            if not address:
+                self.send_json(400, {"error": "missing 'address' query parameter"})
+                return
+            self.send_lookup([address], single=True)
+        else:
+            self.send_json(404, {"error": f"unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/lookup/batch":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("the body must be a JSON object")
+            addresses = body["addresses"]
+            if not isinstance(addresses, list) or not all(isinstance(address, str) for address in addresses):
+                raise ValueError("'addresses' must be a list of strings")
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": f"invalid batch request: {e}"})
+            return
+        if len(addresses) > SERVICE_MAX_BATCH:
+            self.send_json(413, {"error": f"at most {SERVICE_MAX_BATCH} addresses per batch"})
+            return
+        self.send_lookup(addresses, single=False)
+
+    def send_lookup(self, addresses, single):
+        SERVICE_STATS["requests"] += 1
+        try:
+            results = lookup_addresses(addresses)
+        except Exception as e:
+            SERVICE_STATS["errors"] += 1
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, results[0] if single else {"results": results})
+
+    def log_message(self, format, *args):
+        # One line per request, only with --log-level DEBUG
+        log.debug(f"{self.address_string()} - {format % args}")
+
+    def send_json(self, status, payload):
+        # Attribute values may be QGIS types, which are sent as text
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Do the slow startup work once: layers, their indexes / bulk join arrays and the geocode cache
+def warm_lookup_service():
+    load_pipeline_layers(layer_name_path)
+    if BULK_JOIN_MODE:
+        for layer_name in layer_name_path.keys():
+            for loaded_layer in get_loaded_layers(layer_name):
+                get_bulk_layer(loaded_layer)
+    with _geocode_cache_lock:
+        cached = get_geocode_cache().execute("SELECT count(*) FROM geocode_cache WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+    log.info(f"Geocode cache ready: {cached} entries")
+
+def serve_lookups(host=SERVICE_HOST, port=SERVICE_PORT):
+    global _service_started_at
+    warm_lookup_service()
+    _service_started_at = time.time()
+    server = ThreadingHTTPServer((host, port), LookupRequestHandler)
+    log.info(f"\033[92mBIN lookup service listening on http://{host}:{port}\033[0m")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Stopping BIN lookup service")
+    finally:
+        server.server_close()
+
+#endregion Lookup Service
 
 
 if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Find parcel / building attributes and BINs for Atlanta addresses.")
+    parser.add_argument("--sync-mirror", action="store_true", help="download ARC_SERVICES into the local GeoPackage mirror and exit")
+    parser.add_argument("--use-mirror", action="store_true", help="run Step 2.2 against the local mirror instead of the live services")
+    parser.add_argument("--bulk-join", action="store_true", help="run Step 2.1 as one vectorized spatial join per chunk (needs shapely 2)")
+    parser.add_argument("--no-resume", action="store_true", help="ignore the checkpoint of an interrupted run and start over")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse the rows whose address, geocode and nearby source data are unchanged since the previous run")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (default: 1, no pool)")
+    parser.add_argument("--serve", action="store_true", help="run the BIN lookup service instead of processing csv_input")
+    parser.add_argument("--host", default=SERVICE_HOST, help=f"lookup service host (default: {SERVICE_HOST})")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help=f"lookup service port (default: {SERVICE_PORT})")
+    parser.add_argument("--backend", choices=["auto", "qgis", "shapely"], default=GEOMETRY_BACKEND,
+                        help="geometry backend for the loaded layers (shapely runs without QGIS)")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default=LOG_LEVEL,
+                        help="console log level; DEBUG shows the per-address progress (default: INFO)")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="write the stage timings and counters at the end of the run (.prom / .txt: Prometheus text, else JSON)")
+    args = parser.parse_args()
+    GEOMETRY_BACKEND = args.backend
+    configure_logging(args.log_level)
+
+    if args.sync_mirror:
+        synced = sync_arc_mirror()
+        exit_qgis()
+        raise SystemExit(0 if synced else 1)
+
+    ARC_USE_MIRROR = ARC_USE_MIRROR or args.use_mirror
+    BULK_JOIN_MODE = BULK_JOIN_MODE or args.bulk_join
     
-    # load each layer from the dictionary
-    for layer_name, layer_path in layer_name_path.items():
-        load_layers(project_path, layer_name, layer_path)
+    if args.serve:
+        serve_lookups(args.host, args.port)
+        exit_qgis()
+        raise SystemExit(0)
+
+    # load each layer from the dictionary (worker processes load their own)
+    if args.workers <= 1:
+        load_pipeline_layers(layer_name_path)
     
     # Start timer
     start_time = time.time()
-    from qgis.core import QgsProcessingFeedback
-    feedback = QgsProcessingFeedback()
-    feedback.setProgress(100)
+    if get_geometry_backend() == "qgis":
+        from qgis.core import QgsProcessingFeedback
+        feedback = QgsProcessingFeedback()
+        feedback.setProgress(100)
 
-    results = readcsv_and_find_attributes(csv_input , layer_name_path )
+    try:
+        run_pipeline(csv_input, csv_output, layer_name_path, resume=not args.no_resume, workers=args.workers,
+                     incremental=args.incremental)
+    finally:
+        # Also for an interrupted run, which is when the numbers are most wanted
+        log_stage_summary()
+        if args.metrics:
+            export_metrics(args.metrics)
 
    # process_csv_to_layer()
 
-    save_results_to_csv(results, csv_output)
-
-    print("Processing complete. Results saved to:", csv_output)
+    log.info(f"Processing complete. Results saved to: {csv_output}")
+    log.info(f"Geocode cache: {GEOCODE_CACHE_STATS['hits']} hits, {GEOCODE_CACHE_STATS['misses']} misses")
+    log.info(f"Deduplicated rows: {DEDUP_STATS['addresses']} addresses, {DEDUP_STATS['points']} points, {DEDUP_STATS['parcels']} parcels, "
+             f"{DEDUP_STATS['parcel_services']} sharing only the parcel services")
     elapsed = (time.time() - start_time) / 60
-    print(f"\n⏱ Completed in {elapsed:.2f} minutes.")
-    qgs.exitQgis()
+    log.info(f"\n⏱ Completed in {elapsed:.2f} minutes.")
+    exit_qgis()
 
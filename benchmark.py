@@ -0,0 +1,704 @@
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import assignment
+from assignment import (
+    ATTRIBUTE_KEYS,
+    LAYER_INDEXES,
+    OUTPUT_FIELDNAMES,
+    POSSIBLE_PARCEL_ID_KEYS,
+    bulk_join_points,
+    configure_logging,
+    create_bin,
+    drain_metrics,
+    exit_qgis,
+    find_attribute_value_via_laoded_layer,
+    geocode_address,
+    geocode_addresses,
+    get_bulk_layer,
+    get_loaded_layers,
+    layer_name_path,
+    load_layers,
+    metrics_report,
+    project_path,
+    query_arcgis_services,
+    query_arcgis_services_batch,
+    read_addresses,
+    reproject_points_to_layers,
+    resolve_attributes_via_loaded_layer,
+    run_pipeline,
+)
+
+# Optional: only the synthetic benchmark suite needs them
+try:
+    import numpy as np
+    import pyogrio
+    import shapely
+    from pyproj import Transformer
+except ImportError:
+    np = None
+
+#region GLOBAL VARIABLES----------
+
+# CSV with already geocoded 'lat' / 'lon' columns used as sample addresses
+benchmark_points_csv = project_path + "Output_Files/output_results.csv"
+
+# Number of times each sample point is looked up per layer
+BENCHMARK_REPEATS = 3
+
+# Synthetic benchmark suite (--suite): generated layers / address CSVs and the results of every run
+BENCHMARK_DATA_DIR = project_path + "Benchmark_Data/"
+BENCHMARK_HISTORY_PATH = project_path + "Output_Files/benchmark_history.jsonl"
+BENCHMARK_SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+# Addresses timed by the per-stage scenarios (the pipeline scenario runs the whole CSV)
+BENCHMARK_STAGE_SAMPLE = 1000
+# Each scenario runs this many times and keeps the median of every metric; a metric more than
+# BENCHMARK_REGRESSION_THRESHOLD slower than its median over the last BENCHMARK_BASELINE_RUNS comparable runs is a regression
+BENCHMARK_SUITE_REPEATS = 3
+BENCHMARK_BASELINE_RUNS = 5
+BENCHMARK_REGRESSION_THRESHOLD = 0.2
+# Slowdowns smaller than this (seconds per item) are timer noise, whatever their share
+BENCHMARK_REGRESSION_MIN_SECONDS = 0.00001
+BENCHMARK_SEED = 42
+
+# Synthetic city: a grid of square parcels starting at SYNTHETIC_ORIGIN (lat, lon), each with a footprint
+# covering its inner part. Only SYNTHETIC_LOCAL_FOOTPRINT_SHARE of the footprints are in the local layer,
+# the others are only found on the stand-in ArcGIS footprint service (Step 2.2).
+SYNTHETIC_ORIGIN = (33.70, -84.45)
+SYNTHETIC_CELL_SIZE = 0.0003            # degrees (~30 m)
+SYNTHETIC_FOOTPRINT_MARGIN = 0.2        # share of the cell edge left between parcel and footprint boundaries
+SYNTHETIC_LOCAL_FOOTPRINT_SHARE = 0.7
+SYNTHETIC_UNKNOWN_SHARE = 0.02          # addresses the stand-in geocoder does not find
+SYNTHETIC_DUPLICATE_SHARE = 0.1         # addresses repeating an earlier row
+SYNTHETIC_LAYER_CRS = "EPSG:2240"       # same CRS as the Atlanta shapefiles, so Step 2.1 reprojects
+# Matched case-insensitively and without the comma, as the geocoders get normalize_address() queries
+SYNTHETIC_ADDRESS = re.compile(r"^(\d+) Synthetic Row (\d+)\b", re.IGNORECASE)
+
+# Stand-in ArcGIS services: (path, fields, feature kind)
+STUB_ARC_SERVICES = [
+    ("/arcgis/rest/services/TaxParcel/MapServer/0", ["OBJECTID", "PARCELID"], "parcel"),
+    ("/arcgis/rest/services/TaxParcelFulton/FeatureServer/0", ["OBJECTID", "PIN"], "parcel"),
+    ("/arcgis/rest/services/StructureFootprints/MapServer/10", ["OBJECTID", "STRUCTUREID", "STORIES"], "footprint"),
+]
+STUB_MAX_RECORD_COUNT = 1000
+
+#endregion GLOBAL VARIABLES --------
+
+def read_sample_points(csv_path):
+    points = []
+    with open(csv_path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            if row.get("lat") and row.get("lon"):
+                points.append((float(row["lat"]), float(row["lon"])))
+    return points
+
+# Time the per-address Parcel_ID lookup on a loaded layer
+def time_layer_lookup(loaded_layer, points, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for lat, lon in points:
+            find_attribute_value_via_laoded_layer(loaded_layer, lat, lon, 'Parcel_ID', None, POSSIBLE_PARCEL_ID_KEYS)
+    return (time.perf_counter() - start) / (repeats * len(points))
+
+def benchmark_layer_lookup(points, repeats=BENCHMARK_REPEATS):
+    """Compare the per-address lookup cost of the spatial index against a full layer scan."""
+    report = []
+    for layer_name in layer_name_path.keys():
+        loaded_layer = get_loaded_layers(layer_name)[0]
+
+        indexed_cost = time_layer_lookup(loaded_layer, points, repeats)
+        if loaded_layer.id() not in LAYER_INDEXES:
+            # shapely backend: the STRtree is the only lookup path, there is no full scan to compare against
+            report.append((layer_name, loaded_layer.featureCount(), float("nan"), indexed_cost))
+            continue
+
+        # Temporarily drop the index so the lookup falls back to the full layer scan
+        index = LAYER_INDEXES.pop(loaded_layer.id())
+        try:
+            full_scan_cost = time_layer_lookup(loaded_layer, points, repeats)
+        finally:
+            LAYER_INDEXES[loaded_layer.id()] = index
+
+        report.append((layer_name, loaded_layer.featureCount(), full_scan_cost, indexed_cost))
+
+    print("\n\033[93mPer-address lookup cost\033[0m")
+    print(f"{'Layer':<24}{'Features':>10}{'Full scan (ms)':>18}{'Indexed (ms)':>16}{'Speedup':>10}")
+    for layer_name, feature_count, full_scan_cost, indexed_cost in report:
+        speedup = full_scan_cost / indexed_cost if indexed_cost else float("inf")
+        print(f"{layer_name:<24}{feature_count:>10}{full_scan_cost * 1000:>18.3f}{indexed_cost * 1000:>16.3f}{speedup:>9.1f}x")
+    return report
+
+# Time Step 2.1 for all sample points: per-address lookups against one bulk spatial join
+def benchmark_bulk_join(points, repeats=BENCHMARK_REPEATS):
+    """Compare the per-point cost of resolve_attributes_via_loaded_layer() against bulk_join_points()."""
+    loaded_layers = [get_loaded_layers(layer_name)[0] for layer_name in layer_name_path.keys()]
+    for loaded_layer in loaded_layers:
+        # Built once per run, like the spatial index in load_layers()
+        get_bulk_layer(loaded_layer)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for lat, lon in points:
+            for loaded_layer in loaded_layers:
+                resolve_attributes_via_loaded_layer(loaded_layer, lat, lon, ATTRIBUTE_KEYS)
+    per_address_cost = (time.perf_counter() - start) / (repeats * len(points))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        projected_points = reproject_points_to_layers(points, loaded_layers)
+        bulk_join_points(loaded_layers, projected_points, len(points))
+    bulk_cost = (time.perf_counter() - start) / (repeats * len(points))
+
+    speedup = per_address_cost / bulk_cost if bulk_cost else float("inf")
+    print("\n\033[93mStep 2.1 cost per address\033[0m")
+    print(f"{'Points':>10}{'Per-address (ms)':>20}{'Bulk join (ms)':>18}{'Speedup':>10}")
+    print(f"{len(points):>10}{per_address_cost * 1000:>20.3f}{bulk_cost * 1000:>18.3f}{speedup:>9.1f}x")
+    return per_address_cost, bulk_cost
+
+# region Synthetic Data
+
+def synthetic_grid_columns(parcel_count):
+    return math.ceil(math.sqrt(parcel_count))
+
+def synthetic_address(row, col):
+    return f"{col + 1} Synthetic Row {row + 1}, Atlanta, GA"
+
+# Location the stand-in geocoder returns for a synthetic address: inside its parcel's footprint
+def synthetic_location(address, parcel_count):
+    """Returns (lat, lon), or None for an address outside the synthetic grid."""
+    match = SYNTHETIC_ADDRESS.match(address)
+    if not match:
+        return None
+    col, row = int(match.group(1)) - 1, int(match.group(2)) - 1
+    if col >= synthetic_grid_columns(parcel_count) or row * synthetic_grid_columns(parcel_count) + col >= parcel_count:
+        return None
+    # Stable offset from the cell centre, well inside the footprint
+    digest = hashlib.md5(address.encode()).digest()
+    dx, dy = (digest[0] / 255 - 0.5) * 0.5, (digest[1] / 255 - 0.5) * 0.5
+    return (SYNTHETIC_ORIGIN[0] + (row + 0.5 + dy) * SYNTHETIC_CELL_SIZE,
+            SYNTHETIC_ORIGIN[1] + (col + 0.5 + dx) * SYNTHETIC_CELL_SIZE)
+
+# Parcel and footprint (if the point is inside it) containing a point, by grid arithmetic
+def synthetic_cell(lat, lon, parcel_count):
+    """Returns (row, col, in_footprint), or None outside the grid."""
+    columns = synthetic_grid_columns(parcel_count)
+    y = (lat - SYNTHETIC_ORIGIN[0]) / SYNTHETIC_CELL_SIZE
+    x = (lon - SYNTHETIC_ORIGIN[1]) / SYNTHETIC_CELL_SIZE
+    row, col = math.floor(y), math.floor(x)
+    if row < 0 or col < 0 or col >= columns or row * columns + col >= parcel_count:
+        return None
+    margin = SYNTHETIC_FOOTPRINT_MARGIN
+    in_footprint = margin <= y - row <= 1 - margin and margin <= x - col <= 1 - margin
+    return row, col, in_footprint
+
+def synthetic_attributes(row, col, columns):
+    return {"OBJECTID": row * columns + col + 1,
+            "PARCELID": f"SYN-{row:04d}-{col:04d}",
+            "PIN": f"SYN-{row:04d}-{col:04d}",
+            "STRUCTUREID": f"SYN-B-{row:04d}-{col:04d}",
+            "STORIES": 1 + (row + col) % 5}
+
+# Corners (lon, lat) of a parcel, or of its footprint with the margin
+def synthetic_ring(row, col, margin=0.0):
+    x0 = SYNTHETIC_ORIGIN[1] + (col + margin) * SYNTHETIC_CELL_SIZE
+    x1 = SYNTHETIC_ORIGIN[1] + (col + 1 - margin) * SYNTHETIC_CELL_SIZE
+    y0 = SYNTHETIC_ORIGIN[0] + (row + margin) * SYNTHETIC_CELL_SIZE
+    y1 = SYNTHETIC_ORIGIN[0] + (row + 1 - margin) * SYNTHETIC_CELL_SIZE
+    return [[x0, y0], [x0, y1], [x1, y1], [x1, y0], [x0, y0]]
+
+def synthetic_paths(data_dir, size):
+    return data_dir + f"synthetic_{size}.gpkg", data_dir + f"synthetic_{size}_addresses.csv"
+
+# Write the synthetic Tax_Parcels / Structure_Footprints layers and address CSV for a size, once
+def generate_synthetic_data(data_dir, size):
+    """Returns (gpkg path, csv path, parcel count)."""
+    if np is None:
+        raise RuntimeError("the benchmark suite needs numpy, shapely 2, pyproj and pyogrio")
+    rows = BENCHMARK_SIZES[size]
+    gpkg_path, csv_path = synthetic_paths(data_dir, size)
+    if os.path.exists(gpkg_path) and os.path.exists(csv_path):
+        return gpkg_path, csv_path, rows
+
+    os.makedirs(data_dir, exist_ok=True)
+    columns = synthetic_grid_columns(rows)
+    rng = np.random.default_rng(BENCHMARK_SEED)
+    index = np.arange(rows)
+    grid_rows, grid_cols = index // columns, index % columns
+    x0 = SYNTHETIC_ORIGIN[1] + grid_cols * SYNTHETIC_CELL_SIZE
+    y0 = SYNTHETIC_ORIGIN[0] + grid_rows * SYNTHETIC_CELL_SIZE
+    transformer = Transformer.from_crs("EPSG:4326", SYNTHETIC_LAYER_CRS, always_xy=True)
+    to_layer_crs = lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+
+    parcels = shapely.transform(shapely.box(x0, y0, x0 + SYNTHETIC_CELL_SIZE, y0 + SYNTHETIC_CELL_SIZE), to_layer_crs)
+    parcel_ids = np.array([f"SYN-{r:04d}-{c:04d}" for r, c in zip(grid_rows, grid_cols)], dtype=object)
+    write_synthetic_layer(gpkg_path, "Tax_Parcels", parcels, ["PARCELID"], [parcel_ids])
+
+    local = rng.random(rows) < SYNTHETIC_LOCAL_FOOTPRINT_SHARE
+    margin = SYNTHETIC_FOOTPRINT_MARGIN * SYNTHETIC_CELL_SIZE
+    footprints = shapely.transform(shapely.box(x0[local] + margin, y0[local] + margin,
+                                               x0[local] + SYNTHETIC_CELL_SIZE - margin, y0[local] + SYNTHETIC_CELL_SIZE - margin),
+                                   to_layer_crs)
+    structure_ids = np.array([f"SYN-B-{r:04d}-{c:04d}" for r, c in zip(grid_rows[local], grid_cols[local])], dtype=object)
+    stories = (1 + (grid_rows[local] + grid_cols[local]) % 5).astype("int32")
+    write_synthetic_layer(gpkg_path, "Structure_Footprints", footprints, ["STRUCTUREID", "STORIES"], [structure_ids, stories])
+
+    # Addresses of random parcels, with repeats and a few the geocoder does not know
+    addresses = []
+    parcels_drawn = rng.integers(0, rows, size=rows)
+    draws = rng.random(rows)
+    for i in range(rows):
+        if addresses and draws[i] < SYNTHETIC_DUPLICATE_SHARE:
+            addresses.append(addresses[int(draws[i] * 1e9) % len(addresses)])
+        elif draws[i] > 1 - SYNTHETIC_UNKNOWN_SHARE:
+            addresses.append(f"{i + 1} Nowhere Rd, Atlanta, GA")
+        else:
+            addresses.append(synthetic_address(int(parcels_drawn[i] // columns), int(parcels_drawn[i] % columns)))
+    with open(csv_path, "w", newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["address"])
+        writer.writerows([address] for address in addresses)
+    print(f"Synthetic {size} data written to {data_dir}")
+    return gpkg_path, csv_path, rows
+
+def write_synthetic_layer(gpkg_path, layer_name, geometries, fields, field_data):
+    pyogrio.raw.write(gpkg_path, shapely.to_wkb(geometries), field_data=field_data, fields=fields, layer=layer_name,
+                      driver="GPKG", crs=SYNTHETIC_LAYER_CRS, geometry_type="Polygon")
+
+#endregion Synthetic Data
+
+# region Stub Servers
+
+def stub_config(latency=0.0, jitter=0.0, failure_rate=0.0, rate_limit=None):
+    """latency / jitter in seconds per request, failure_rate of HTTP 500 answers, rate_limit in requests per second (HTTP 429 above it)."""
+    return {"latency": latency, "jitter": jitter, "failure_rate": failure_rate, "rate_limit": rate_limit}
+
+class StubServer(ThreadingHTTPServer):
+    """A local HTTP server with the latency, failures and rate limit of stub_config()."""
+
+    daemon_threads = True
+
+    def __init__(self, handler_class, config, parcel_count):
+        super().__init__(("127.0.0.1", 0), handler_class)
+        self.config = config
+        self.parcel_count = parcel_count
+        self.random = random.Random(BENCHMARK_SEED)
+        self.lock = threading.Lock()
+        # Token bucket of the rate limit
+        self.tokens = config["rate_limit"] or 0
+        self.refilled_at = time.monotonic()
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def admit(self):
+        """Returns the HTTP status the request gets: 200, 429 (rate limited) or 500 (injected failure)."""
+        with self.lock:
+            self.requests += 1
+            rate_limit = self.config["rate_limit"]
+            if rate_limit:
+                now = time.monotonic()
+                self.tokens = min(rate_limit, self.tokens + (now - self.refilled_at) * rate_limit)
+                self.refilled_at = now
+                if self.tokens < 1:
+                    return 429
+                self.tokens -= 1
+            delay = self.config["latency"] + self.random.uniform(0, self.config["jitter"])
+            failed = self.random.random() < self.config["failure_rate"]
+        time.sleep(delay)
+        return 500 if failed else 200
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.handle_request("")
+
+    # Form POST, as ArcGIS accepts for a /query too long for a url
+    def do_POST(self):
+        self.handle_request(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+
+    def handle_request(self, form):
+        url = urlparse(self.path)
+        status = self.server.admit()
+        if status != 200:
+            self.send_json(status, {"error": {"code": status, "message": "stub failure"}})
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        query.update({key: values[0] for key, values in parse_qs(form).items()})
+        self.handle_query(url.path, query)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubGeocoderHandler(StubRequestHandler):
+    """Nominatim GET /search?q= and Google GET /maps/api/geocode/json?address= for the synthetic addresses."""
+
+    def handle_query(self, path, query):
+        if path == "/search":
+            location = synthetic_location(query.get("q", ""), self.server.parcel_count)
+            results = [] if location is None else [{"lat": str(location[0]), "lon": str(location[1]), "display_name": query["q"]}]
+            self.send_json(200, results)
+        elif path == "/maps/api/geocode/json":
+            location = synthetic_location(query.get("address", ""), self.server.parcel_count)
+            if location is None:
+                self.send_json(200, {"status": "ZERO_RESULTS", "results": []})
+            else:
+                self.send_json(200, {"status": "OK", "results": [{"geometry": {"location": {"lat": location[0], "lng": location[1]}}}]})
+        else:
+            self.send_json(404, {"error": f"unknown path {path}"})
+
+class StubArcGISHandler(StubRequestHandler):
+    """Layer metadata (f=json) and /query of the STUB_ARC_SERVICES, for point and multipoint geometries, with pagination."""
+
+    def handle_query(self, path, query):
+        for service_path, fields, kind in STUB_ARC_SERVICES:
+            if path == service_path:
+                self.send_json(200, {"fields": [{"name": name, "type": "esriFieldTypeOID" if name == "OBJECTID" else "esriFieldTypeString"}
+                                                for name in fields],
+                                     "objectIdField": "OBJECTID", "maxRecordCount": STUB_MAX_RECORD_COUNT,
+                                     "advancedQueryCapabilities": {"supportsPagination": True}})
+                return
+            if path == service_path + "/query":
+                self.send_query(query, fields, kind)
+                return
+        self.send_json(404, {"error": {"code": 404, "message": f"unknown path {path}"}})
+
+    def send_query(self, query, fields, kind):
+        geometry = query.get("geometry", "")
+        if query.get("geometryType") == "esriGeometryMultipoint":
+            points = json.loads(geometry)["points"]
+        else:
+            points = [[float(value) for value in geometry.split(",")]]
+
+        columns = synthetic_grid_columns(self.server.parcel_count)
+        features = {}
+        for lon, lat in points:
+            cell = synthetic_cell(lat, lon, self.server.parcel_count)
+            if cell is None or (kind == "footprint" and not cell[2]):
+                continue
+            row, col, _ = cell
+            attributes = synthetic_attributes(row, col, columns)
+            out_fields = fields if query.get("outFields", "*") == "*" else ["OBJECTID"] + query["outFields"].split(",")
+            ring = synthetic_ring(row, col, SYNTHETIC_FOOTPRINT_MARGIN if kind == "footprint" else 0.0)
+            features[attributes["OBJECTID"]] = ({name: attributes[name] for name in out_fields if name in attributes}, ring)
+
+        offset = int(query.get("resultOffset", 0))
+        count = min(int(query.get("resultRecordCount", STUB_MAX_RECORD_COUNT)), STUB_MAX_RECORD_COUNT)
+        page = [features[object_id] for object_id in sorted(features)][offset:offset + count]
+        with_geometry = query.get("returnGeometry", "true") == "true"
+        if query.get("f") == "geojson":
+            payload = {"type": "FeatureCollection",
+                       "features": [{"type": "Feature", "properties": attributes,
+                                     "geometry": {"type": "Polygon", "coordinates": [ring]} if with_geometry else None}
+                                    for attributes, ring in page]}
+            payload["properties"] = {"exceededTransferLimit": offset + count < len(features)}
+        else:
+            payload = {"features": [dict({"attributes": attributes}, **({"geometry": {"rings": [ring]}} if with_geometry else {}))
+                                    for attributes, ring in page],
+                       "exceededTransferLimit": offset + count < len(features)}
+        self.send_json(200, payload)
+
+# Start the stand-in servers and point the pipeline's geocoders and ARC_SERVICES at them
+def start_stub_servers(parcel_count, geocoder_config, arcgis_config):
+    geocoder = StubServer(StubGeocoderHandler, geocoder_config, parcel_count).start()
+    arcgis = StubServer(StubArcGISHandler, arcgis_config, parcel_count).start()
+
+    scheme, _, domain = geocoder.url.partition("://")
+    assignment.NOMINATIM_SCHEME, assignment.NOMINATIM_DOMAIN = scheme, domain
+    assignment.GOOGLE_GEOCODE_URL = geocoder.url + "/maps/api/geocode/json"
+    # In place: the ARC_SERVICES defaults of the query functions refer to this list
+    assignment.ARC_SERVICES[:] = [arcgis.url + service_path for service_path, _, _ in STUB_ARC_SERVICES]
+    # Request spacing follows the stub's rate limit instead of the public Nominatim policy
+    interval = 1 / geocoder_config["rate_limit"] if geocoder_config["rate_limit"] else 0.0
+    assignment.GEOCODE_MIN_INTERVAL.update(nominatim=interval, google=interval)
+    return geocoder, arcgis
+
+#endregion Stub Servers
+
+# region Scenarios
+
+# Point the geocode cache at a new empty file, so a scenario starts cold
+def use_fresh_geocode_cache(scratch_dir, name):
+    if assignment._geocode_cache_conn is not None:
+        assignment._geocode_cache_conn.close()
+        assignment._geocode_cache_conn = None
+    assignment.GEOCODE_CACHE_PATH = os.path.join(scratch_dir, f"{name}-geocode-cache.db")
+    if os.path.exists(assignment.GEOCODE_CACHE_PATH):
+        os.remove(assignment.GEOCODE_CACHE_PATH)
+
+def per_item(seconds, count):
+    return seconds / count if count else None
+
+def scenario_read_csv(context):
+    start = time.perf_counter()
+    row_count = sum(1 for _ in read_addresses(context["csv_path"]))
+    return {"read_csv_s_per_row": per_item(time.perf_counter() - start, row_count)}
+
+def scenario_geocode(context):
+    use_fresh_geocode_cache(context["scratch_dir"], "geocode")
+    addresses = context["sample_addresses"]
+    results = {}
+    # One blocking request at a time, then the engine's concurrent batch (as the pipeline geocodes a chunk)
+    start = time.perf_counter()
+    for address in addresses:
+        geocode_address(address)
+    results["geocode_cold_s_per_address"] = per_item(time.perf_counter() - start, len(addresses))
+    use_fresh_geocode_cache(context["scratch_dir"], "geocode-batch")
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        geocode_addresses(addresses)
+        results[f"geocode_batch_{label}_s_per_address"] = per_item(time.perf_counter() - start, len(addresses))
+    return results
+
+def scenario_reproject(context):
+    start = time.perf_counter()
+    reproject_points_to_layers(context["sample_points"], context["loaded_layers"])
+    return {"reproject_s_per_point": per_item(time.perf_counter() - start, len(context["sample_points"]))}
+
+def scenario_layers(context):
+    points = context["sample_points"]
+    start = time.perf_counter()
+    for lat, lon in points:
+        for loaded_layer in context["loaded_layers"]:
+            resolve_attributes_via_loaded_layer(loaded_layer, lat, lon, ATTRIBUTE_KEYS)
+    results = {"layers_per_address_s_per_point": per_item(time.perf_counter() - start, len(points))}
+    if np is not None:
+        for loaded_layer in context["loaded_layers"]:
+            get_bulk_layer(loaded_layer)
+        start = time.perf_counter()
+        bulk_join_points(context["loaded_layers"], reproject_points_to_layers(points, context["loaded_layers"]), len(points))
+        results["layers_bulk_join_s_per_point"] = per_item(time.perf_counter() - start, len(points))
+    return results
+
+def scenario_arcgis(context):
+    points = context["sample_points"]
+    start = time.perf_counter()
+    for lat, lon in points:
+        query_arcgis_services(lat, lon)
+    results = {"arcgis_per_address_s_per_point": per_item(time.perf_counter() - start, len(points))}
+    start = time.perf_counter()
+    query_arcgis_services_batch(points)
+    results["arcgis_batch_s_per_point"] = per_item(time.perf_counter() - start, len(points))
+    return results
+
+def scenario_bin(context):
+    start = time.perf_counter()
+    for i in range(len(context["sample_points"])):
+        create_bin(f"SYN-{i:08d}", f"SYN-B-{i:08d}")
+    return {"bin_s_per_row": per_item(time.perf_counter() - start, len(context["sample_points"]))}
+
+def scenario_csv_write(context):
+    rows = [dict.fromkeys(OUTPUT_FIELDNAMES, "x") for _ in context["sample_points"]]
+    start = time.perf_counter()
+    with open(os.path.join(context["scratch_dir"], "csv_write.csv"), "w", newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=OUTPUT_FIELDNAMES)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    return {"csv_write_s_per_row": per_item(time.perf_counter() - start, len(rows))}
+
+# The whole pipeline over the CSV, with the per-stage metrics of the run
+def scenario_pipeline(context):
+    use_fresh_geocode_cache(context["scratch_dir"], "pipeline")
+    drain_metrics()
+    output_csv = os.path.join(context["scratch_dir"], "pipeline_output.csv")
+    start = time.perf_counter()
+    rows_done = run_pipeline(context["csv_path"], output_csv, context["layer_name_path"], resume=False)
+    elapsed = time.perf_counter() - start
+    results = {"pipeline_s_per_row": per_item(elapsed, rows_done)}
+    for stage, metric in metrics_report()["stages"].items():
+        # Service URLs contain the stub's random port, so key the ArcGIS stages by service path
+        stage_key = re.sub(r"https?://[^/]+", "", stage)
+        results[f"stage_mean_s:{stage_key}"] = metric["sum_seconds"] / metric["count"]
+    return results
+
+# Scenarios in pipeline order: read, Step 1, reprojection, Step 2.1, Step 2.2, BIN, output, then all of it together
+SCENARIOS = {
+    "read_csv": scenario_read_csv,
+    "geocode": scenario_geocode,
+    "reproject": scenario_reproject,
+    "layers": scenario_layers,
+    "arcgis": scenario_arcgis,
+    "bin": scenario_bin,
+    "csv_write": scenario_csv_write,
+    "pipeline": scenario_pipeline,
+}
+
+def run_benchmark_suite(size, scenarios, geocoder_config, arcgis_config, data_dir=BENCHMARK_DATA_DIR, repeats=BENCHMARK_SUITE_REPEATS):
+    """Runs the scenarios against synthetic data of the given size and the stand-in servers; returns the history record."""
+    gpkg_path, csv_path, parcel_count = generate_synthetic_data(data_dir, size)
+    geocoder, arcgis = start_stub_servers(parcel_count, geocoder_config, arcgis_config)
+    synthetic_layer_name_path = {layer_name: f"{os.path.basename(gpkg_path)}|layername={layer_name}"
+                                 for layer_name in ("Tax_Parcels", "Structure_Footprints")}
+    for layer_name, layer_path in synthetic_layer_name_path.items():
+        load_layers(data_dir, layer_name, layer_path)
+
+    sample_addresses = [address for _, address in read_addresses(csv_path) if address][:BENCHMARK_STAGE_SAMPLE]
+    sample_points = [point for point in (synthetic_location(address, parcel_count) for address in sample_addresses) if point]
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        context = {"csv_path": csv_path, "scratch_dir": scratch_dir, "layer_name_path": synthetic_layer_name_path,
+                   "sample_addresses": sample_addresses, "sample_points": sample_points,
+                   "loaded_layers": [get_loaded_layers(layer_name)[0] for layer_name in synthetic_layer_name_path]}
+        results = {}
+        for name in scenarios:
+            samples = {}
+            for repeat in range(1, repeats + 1):
+                print(f"\n\033[93mScenario {name} ({size}), run {repeat}/{repeats}\033[0m")
+                for metric, value in SCENARIOS[name](context).items():
+                    samples.setdefault(metric, []).append(value)
+            results[name] = median_metrics(samples)
+        # Close the cache before its scratch directory goes away
+        use_fresh_geocode_cache(scratch_dir, "closed")
+    geocoder.shutdown()
+    arcgis.shutdown()
+
+    return {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+            "size": size, "rows": parcel_count, "backend": assignment.get_geometry_backend(),
+            "geocoder_stub": geocoder_config, "arcgis_stub": arcgis_config, "repeats": repeats, "results": results}
+
+def median_metrics(samples):
+    """samples is {metric: [values]}; returns {metric: median}, None for a metric without any value."""
+    medians = {}
+    for metric, values in samples.items():
+        values = [value for value in values if value is not None]
+        medians[metric] = statistics.median(values) if values else None
+    return medians
+
+#endregion Scenarios
+
+# region Results History
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(history_path):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, encoding='utf-8') as history_file:
+        return [json.loads(line) for line in history_file if line.strip()]
+
+def append_history(history_path, record):
+    os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+    with open(history_path, "a", encoding='utf-8') as history_file:
+        history_file.write(json.dumps(record) + "\n")
+
+# Latest earlier runs with the same size, backend and stand-in server settings, newest first
+def previous_comparable_runs(history, record, count=BENCHMARK_BASELINE_RUNS):
+    keys = ("size", "backend", "geocoder_stub", "arcgis_stub")
+    return [previous for previous in reversed(history) if all(previous.get(key) == record[key] for key in keys)][:count]
+
+# Median of every metric over previous runs, the baseline a new run is compared with
+def baseline_run(previous_runs):
+    """Returns a record-like {"runs": count, "results": {scenario: {metric: median}}}, or None without previous runs."""
+    if not previous_runs:
+        return None
+    samples = {}
+    for previous in previous_runs:
+        for scenario, metrics in previous["results"].items():
+            for metric, value in metrics.items():
+                samples.setdefault(scenario, {}).setdefault(metric, []).append(value)
+    return {"runs": len(previous_runs), "results": {scenario: median_metrics(metrics) for scenario, metrics in samples.items()}}
+
+def find_regressions(previous, record, threshold=BENCHMARK_REGRESSION_THRESHOLD):
+    """previous is a record or baseline_run(); returns [(scenario, metric, previous seconds, new seconds)] for the metrics more than threshold slower."""
+    regressions = []
+    for scenario, metrics in record["results"].items():
+        for metric, value in metrics.items():
+            old_value = previous["results"].get(scenario, {}).get(metric)
+            if (value is not None and old_value and value > old_value * (1 + threshold)
+                    and value - old_value > BENCHMARK_REGRESSION_MIN_SECONDS):
+                regressions.append((scenario, metric, old_value, value))
+    return regressions
+
+def print_suite_report(record, previous):
+    print(f"\n\033[93mBenchmark {record['size']} ({record['backend']} backend, commit {record['commit']}), "
+          f"median of {record['repeats']} runs against the median of {previous['runs'] if previous else 0} previous runs\033[0m")
+    print(f"{'Scenario':<12}{'Metric':<72}{'Now (ms)':>12}{'Before (ms)':>14}")
+    for scenario, metrics in record["results"].items():
+        for metric, value in metrics.items():
+            old_value = previous["results"].get(scenario, {}).get(metric) if previous else None
+            now = f"{value * 1000:.3f}" if value is not None else "-"
+            before = f"{old_value * 1000:.3f}" if old_value is not None else "-"
+            print(f"{scenario:<12}{metric[:71]:<72}{now:>12}{before:>14}")
+
+#endregion Results History
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the address pipeline.")
+    parser.add_argument("--suite", action="store_true",
+                        help="run the synthetic benchmark suite against local stand-in servers instead of the real layers")
+    parser.add_argument("--size", choices=list(BENCHMARK_SIZES), default="1k", help="synthetic data size (default: 1k)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in server latency per request, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency per request, up to this many seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of stand-in requests answered with HTTP 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="stand-in geocoder requests per second (HTTP 429 above)")
+    parser.add_argument("--arcgis-rate-limit", type=float, default=None, help="stand-in ArcGIS requests per second (HTTP 429 above)")
+    parser.add_argument("--repeats", type=int, default=BENCHMARK_SUITE_REPEATS,
+                        help=f"runs of each scenario, the median is kept (default: {BENCHMARK_SUITE_REPEATS})")
+    parser.add_argument("--data-dir", default=BENCHMARK_DATA_DIR, help="where the synthetic layers and CSVs are generated")
+    parser.add_argument("--history", default=BENCHMARK_HISTORY_PATH, help="JSON lines file the suite results are appended to")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help=f"exit with status 1 when a metric is more than {BENCHMARK_REGRESSION_THRESHOLD * 100:.0f}%% slower "
+                             f"than its median over the last {BENCHMARK_BASELINE_RUNS} comparable runs")
+    parser.add_argument("--backend", choices=["auto", "qgis", "shapely"], default=assignment.GEOMETRY_BACKEND)
+    args = parser.parse_args()
+    assignment.GEOMETRY_BACKEND = args.backend
+
+    configure_logging()
+
+    if args.suite:
+        geocoder_config = stub_config(args.latency, args.jitter, args.failure_rate, args.rate_limit)
+        arcgis_config = stub_config(args.latency, args.jitter, args.failure_rate, args.arcgis_rate_limit)
+        record = run_benchmark_suite(args.size, args.scenarios, geocoder_config, arcgis_config, os.path.join(args.data_dir, ""),
+                                     args.repeats)
+        previous = baseline_run(previous_comparable_runs(load_history(args.history), record))
+        append_history(args.history, record)
+        print_suite_report(record, previous)
+        regressions = find_regressions(previous, record) if previous else []
+        for scenario, metric, old_value, value in regressions:
+            print(f"\033[91mRegression in {scenario} / {metric}: {old_value * 1000:.3f} ms -> {value * 1000:.3f} ms\033[0m")
+        exit_qgis()
+        raise SystemExit(1 if regressions and args.fail_on_regression else 0)
+
+    for layer_name, layer_path in layer_name_path.items():
+        load_layers(project_path, layer_name, layer_path)
+
+    sample_points = read_sample_points(benchmark_points_csv)
+    benchmark_layer_lookup(sample_points)
+    benchmark_bulk_join(sample_points)
+
+    exit_qgis()